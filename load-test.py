@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+Load test for MetalSense Environmental Calculations API
+Replays a realistic mix of calculation requests at a configurable concurrency,
+standing in for the traffic the Node backend and frontend generate, and reports
+throughput, p50/p95/p99 latency and error rate per route.
+
+Requires httpx (pip install httpx). Run against a running service:
+    python load-test.py --concurrency 32 --requests 5000
+or against the FastAPI app in-process, without starting uvicorn:
+    python load-test.py --in-process --duration 30
+
+Against a running service the generated samples are permanently added to its
+ingest index and result store, labelled with sample_ids starting with
+--sample-id-prefix (LOAD- by default). Run against a disposable instance, or use
+--in-process, which points both at a temporary directory.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+BASE_URL = "http://127.0.0.1:8001"
+SCENARIOS_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "test-data", "sample-metal-data.json")
+
+# Relative frequency of each route in the replayed traffic
+ROUTE_MIX = [
+    ("/calculate/comprehensive", 30),
+    ("/calculate/hpi", 15),
+    ("/calculate/mei", 10),
+    ("/calculate/hazard-index", 10),
+    ("/calculate/carcinogenic-risk", 10),
+    ("/calculate/batch", 15),
+    ("/calculate/batch/matrix", 10)
+]
+
+BATCH_ROUTES = {"/calculate/batch", "/calculate/batch/matrix"}
+
+
+def load_scenarios(path):
+    """Read test scenarios and the WHO standards they are measured against"""
+    with open(path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    standards = {
+        metal: float(value.split()[0])
+        for metal, value in data["who_standards_reference"].items()
+    }
+    return data["test_scenarios"], standards
+
+
+class PayloadFactory:
+    """Builds request bodies from scenarios with varying metal counts and batch sizes"""
+
+    def __init__(self, scenarios, standards, max_batch, duplicate_ratio, seed, sample_id_prefix="LOAD-"):
+        self.scenarios = scenarios
+        self.standards = standards
+        self.max_batch = max_batch
+        self.duplicate_ratio = duplicate_ratio
+        self.random = random.Random(seed)
+        self.sample_id_prefix = sample_id_prefix
+        self.sent = []
+        self.counter = 0
+
+    def data_point(self):
+        # Field teams resubmit samples; replay some earlier ones verbatim
+        if self.sent and self.random.random() < self.duplicate_ratio:
+            return self.random.choice(self.sent)
+
+        scenario = self.random.choice(self.scenarios)
+        measurements = scenario["metal_measurements"]
+        chosen = self.random.sample(measurements, self.random.randint(1, len(measurements)))
+        self.counter += 1
+        point = {
+            "latitude": scenario["location"]["latitude"] + self.random.uniform(-0.05, 0.05),
+            "longitude": scenario["location"]["longitude"] + self.random.uniform(-0.05, 0.05),
+            "sample_id": f"{self.sample_id_prefix}{self.counter:07d}",
+            "sample_date": f"2026-{self.random.randint(1, 12):02d}-{self.random.randint(1, 28):02d}",
+            "metals": [
+                {
+                    "name": m["metal"],
+                    "concentration": m["concentration"] * self.random.uniform(0.5, 1.5),
+                    "standard": self.standards[m["metal"]],
+                    "ideal": 0.0
+                }
+                for m in chosen
+            ]
+        }
+        if len(self.sent) < 10000:
+            self.sent.append(point)
+        return point
+
+    def request(self):
+        """Pick a route by ROUTE_MIX and build its body"""
+        routes, weights = zip(*ROUTE_MIX)
+        route = self.random.choices(routes, weights=weights)[0]
+        if route in BATCH_ROUTES:
+            body = [self.data_point() for _ in range(self.random.randint(1, self.max_batch))]
+        else:
+            body = self.data_point()
+        return route, body
+
+
+def percentile(sorted_values, pct):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+async def worker(client, factory, stats, deadline, budget):
+    while True:
+        if deadline is not None and time.perf_counter() >= deadline:
+            return
+        if budget is not None:
+            if budget["remaining"] <= 0:
+                return
+            budget["remaining"] -= 1
+
+        route, body = factory.request()
+        start = time.perf_counter()
+        try:
+            response = await client.post(route, json=body)
+            ok = response.status_code < 400
+        except httpx.HTTPError:
+            ok = False
+        elapsed = time.perf_counter() - start
+
+        stats[route]["latencies"].append(elapsed)
+        if not ok:
+            stats[route]["errors"] += 1
+
+
+async def run(args):
+    scenarios, standards = load_scenarios(args.scenarios)
+    factory = PayloadFactory(scenarios, standards, args.max_batch, args.duplicate_ratio, args.seed,
+                             args.sample_id_prefix)
+    stats = defaultdict(lambda: {"latencies": [], "errors": 0})
+
+    data_dir = None
+    if args.in_process:
+        # Keep load-test samples out of the service's real ingest index and result store,
+        # even when their locations are exported in the environment
+        data_dir = tempfile.mkdtemp(prefix="metalsense-load-")
+        os.environ["METALSENSE_INGEST_INDEX"] = os.path.join(data_dir, "ingest-index.jsonl")
+        os.environ["METALSENSE_RESULT_STORE"] = os.path.join(data_dir, "results")
+        sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "python-service"))
+        from main import app
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://metalsense.local")
+    else:
+        print(f"⚠️  Samples sent to {args.base_url} stay in its ingest index "
+              f"(sample_ids {args.sample_id_prefix}*)", file=sys.stderr)
+        limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+        client = httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout)
+
+    deadline = time.perf_counter() + args.duration if args.duration else None
+    budget = None if args.duration else {"remaining": args.requests}
+
+    start = time.perf_counter()
+    try:
+        async with client:
+            await asyncio.gather(*(worker(client, factory, stats, deadline, budget) for _ in range(args.concurrency)))
+        wall_time = time.perf_counter() - start
+    finally:
+        if data_dir is not None:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    return summarize(stats, wall_time, args.concurrency)
+
+
+def summarize(stats, wall_time, concurrency):
+    routes = {}
+    all_latencies = []
+    total_errors = 0
+    for route, route_stats in sorted(stats.items()):
+        latencies = sorted(route_stats["latencies"])
+        all_latencies.extend(latencies)
+        total_errors += route_stats["errors"]
+        routes[route] = {
+            "requests": len(latencies),
+            "errors": route_stats["errors"],
+            "error_rate": route_stats["errors"] / len(latencies) if latencies else 0.0,
+            "throughput_rps": len(latencies) / wall_time,
+            "p50_ms": percentile(latencies, 50) * 1000,
+            "p95_ms": percentile(latencies, 95) * 1000,
+            "p99_ms": percentile(latencies, 99) * 1000
+        }
+
+    all_latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "wall_time_s": wall_time,
+        "routes": routes,
+        "total": {
+            "requests": len(all_latencies),
+            "errors": total_errors,
+            "error_rate": total_errors / len(all_latencies) if all_latencies else 0.0,
+            "throughput_rps": len(all_latencies) / wall_time,
+            "p50_ms": percentile(all_latencies, 50) * 1000,
+            "p95_ms": percentile(all_latencies, 95) * 1000,
+            "p99_ms": percentile(all_latencies, 99) * 1000
+        }
+    }
+
+
+def print_report(report):
+    print(f"📊 {report['total']['requests']} requests in {report['wall_time_s']:.2f}s "
+          f"at concurrency {report['concurrency']}")
+    print("=" * 96)
+    print(f"{'route':32} {'reqs':>7} {'err %':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    rows = list(report["routes"].items()) + [("TOTAL", report["total"])]
+    for route, r in rows:
+        print(f"{route:32} {r['requests']:>7} {r['error_rate'] * 100:>7.2f} {r['throughput_rps']:>9.1f} "
+              f"{r['p50_ms']:>9.2f} {r['p95_ms']:>9.2f} {r['p99_ms']:>9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the MetalSense calculations API")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--in-process", action="store_true", help="drive the FastAPI app directly via ASGI")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=1000, help="total requests (ignored with --duration)")
+    parser.add_argument("--duration", type=float, default=None, help="run for this many seconds")
+    parser.add_argument("--max-batch", type=int, default=50, help="largest batch size for batch routes")
+    parser.add_argument("--duplicate-ratio", type=float, default=0.2, help="share of resubmitted samples")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scenarios", default=SCENARIOS_FILE)
+    parser.add_argument("--sample-id-prefix", default="LOAD-", help="label of generated samples in the ingest index")
+    parser.add_argument("--json-out", default=None, help="also write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report)
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\n📝 Report written to {args.json_out}")
+
+
+if __name__ == "__main__":
+    main()
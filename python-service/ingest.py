@@ -0,0 +1,305 @@
+"""
+Ingest canonicalization and sample deduplication for MetalSense.
+
+Field teams report the same metal as "Pb", "lead" or "Lead (Pb)" and mix
+mg/L with µg/L readings. Every sample is reduced to a canonical form (canonical
+metal names, concentrations in mg/L, metals sorted by name) before it is
+hashed, so repeated uploads of the same sample are recognised regardless of
+ordering or notation and are never recomputed or stored twice.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+# Canonical metal names used by the calculators' lookup tables
+CANONICAL_METALS = [
+    "Lead (Pb)",
+    "Cadmium (Cd)",
+    "Mercury (Hg)",
+    "Arsenic (As)",
+    "Chromium (Cr)",
+    "Copper (Cu)",
+    "Zinc (Zn)",
+    "Nickel (Ni)",
+    "Iron (Fe)",
+    "Manganese (Mn)"
+]
+
+CANONICAL_UNIT = "mg/L"
+
+# Conversion factors to mg/L (water density assumed for ppm/ppb)
+UNIT_FACTORS = {
+    "mg/l": 1.0,
+    "ppm": 1.0,
+    "ug/l": 1e-3,
+    "µg/l": 1e-3,  # micro sign
+    "μg/l": 1e-3,  # greek mu
+    "ppb": 1e-3,
+    "ng/l": 1e-6,
+    "g/l": 1000.0
+}
+
+# Fields scaled together with the concentration when converting units
+CONCENTRATION_FIELDS = ("concentration", "standard", "ideal")
+
+
+def _alias_key(name: str) -> str:
+    return re.sub(r"[^a-z]", "", name.lower())
+
+
+_METAL_ALIASES: Dict[str, str] = {}
+for _canonical in CANONICAL_METALS:
+    _element, _symbol = _canonical[:-1].split(" (")
+    for _alias in (_canonical, _element, _symbol):
+        _METAL_ALIASES[_alias_key(_alias)] = _canonical
+
+
+def normalize_metal_name(name: str) -> str:
+    """Map "Pb", "lead", "LEAD (PB)" etc. to "Lead (Pb)"; unknown names are only stripped"""
+    return _METAL_ALIASES.get(_alias_key(name), name.strip())
+
+
+def unit_factor(unit: Optional[str]) -> float:
+    """Return the factor converting a concentration in `unit` to mg/L"""
+    if unit is None:
+        return 1.0
+    key = unit.strip().lower().replace(" ", "")
+    if key not in UNIT_FACTORS:
+        raise ValueError(f"Unsupported concentration unit: {unit}")
+    return UNIT_FACTORS[key]
+
+
+def canonicalize_metal(metal: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a copy of a metal record with a canonical name and mg/L values"""
+    canonical = dict(metal)
+    canonical["name"] = normalize_metal_name(metal["name"])
+    factor = unit_factor(metal.get("unit"))
+    if factor != 1.0:
+        for field in CONCENTRATION_FIELDS:
+            if canonical.get(field) is not None:
+                canonical[field] = canonical[field] * factor
+    canonical["unit"] = CANONICAL_UNIT
+    return canonical
+
+
+def canonicalize_point(point: Dict[str, Any]) -> Dict[str, Any]:
+    """Return a copy of a data point with canonical metals sorted by name"""
+    canonical = dict(point)
+    metals = [canonicalize_metal(metal) for metal in point["metals"]]
+    canonical["metals"] = sorted(metals, key=lambda metal: metal["name"])
+    return canonical
+
+
+def _hashable(value: Any) -> Any:
+    # 12 significant digits absorb float noise from unit conversion
+    if isinstance(value, float):
+        return format(value, ".12g")
+    if isinstance(value, dict):
+        return {key: _hashable(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_hashable(item) for item in value]
+    return value
+
+
+def content_hash(point: Dict[str, Any]) -> str:
+    """
+    SHA-256 of a canonical data point.
+    The sample_id is excluded so relabelled copies of a sample still match.
+    """
+    content = {key: value for key, value in point.items() if key != "sample_id"}
+    encoded = json.dumps(_hashable(content), sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+class IngestIndex:
+    """
+    Append-only on-disk index of unique samples and their computed results.
+
+    The log is replayed into in-memory dicts on startup, so every lookup by
+    sample_id or content hash is O(1) and every write is a single appended line.
+    Results are tagged with the calculator version that produced them; results
+    from any other version are ignored on replay and recomputed on demand.
+    """
+
+    NEW = "new"
+    DUPLICATE = "duplicate"
+    UPDATED = "updated"
+
+    # Change log operations on the set of unique samples
+    ADDED = "added"
+    REMOVED = "removed"
+
+    def __init__(self, path: str, calculator_version: str = ""):
+        self.path = path
+        self.calculator_version = calculator_version
+        self._lock = threading.Lock()
+        # (ADDED | REMOVED, content_hash) per change to the unique samples, so
+        # derived tables can catch up incrementally; aliases are not changes
+        self._changes: List[Tuple[str, str]] = []
+        self._ids: Dict[str, str] = {}
+        # sample_ids (plus id-less submissions) referring to each digest
+        self._refs: Dict[str, int] = {}
+        self._samples: Dict[str, Dict[str, Any]] = {}
+        self._results: Dict[str, Dict[str, Dict[str, Any]]] = {}
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if os.path.exists(path):
+            self._replay()
+        self._log = open(path, "a", encoding="utf-8")
+
+    def _replay(self) -> None:
+        """
+        Apply every record in the log. A final record cut short by a crash mid-write
+        is dropped and truncated away so later appends start on a fresh line; any
+        other unreadable record is an error.
+        """
+        with open(self.path, "rb") as log:
+            lines = log.readlines()
+        end = 0
+        terminated = True
+        for number, line in enumerate(lines, start=1):
+            try:
+                record = json.loads(line) if line.strip() else None
+            except ValueError as e:
+                if number == len(lines):
+                    break
+                raise ValueError(f"Corrupt ingest index record at {self.path}:{number}: {e}") from e
+            if record is not None:
+                self._apply(record)
+            end += len(line)
+            terminated = line.endswith(b"\n")
+        with open(self.path, "r+b") as log:
+            log.truncate(end)
+            if not terminated:
+                # The last record is complete but unterminated
+                log.seek(end)
+                log.write(b"\n")
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        digest = record["content_hash"]
+        if record["type"] == "sample":
+            sample_id = record.get("sample_id")
+            previous = self._ids.get(sample_id) if sample_id is not None else None
+            if previous == digest:
+                return
+            if previous is not None:
+                # A corrected resubmission replaces the earlier content unless
+                # another sample_id still refers to it
+                self._refs[previous] -= 1
+                if self._refs[previous] == 0:
+                    del self._refs[previous]
+                    if self._samples.pop(previous, None) is not None:
+                        self._changes.append((self.REMOVED, previous))
+                    self._results.pop(previous, None)
+            if record.get("sample") is not None and digest not in self._samples:
+                self._samples[digest] = record["sample"]
+                self._changes.append((self.ADDED, digest))
+            self._refs[digest] = self._refs.get(digest, 0) + 1
+            if sample_id is not None:
+                self._ids[sample_id] = digest
+        elif record["type"] == "result":
+            if record.get("calculator_version", "") != self.calculator_version:
+                return
+            self._results.setdefault(digest, {})[record["route"]] = record["result"]
+
+    @property
+    def version(self) -> int:
+        """Number of changes to the unique samples; cursor for changes_since"""
+        return len(self._changes)
+
+    def changes_since(self, cursor: int) -> List[Tuple[str, str]]:
+        """Changes to the unique samples after `cursor` (an earlier version), oldest first"""
+        with self._lock:
+            return self._changes[cursor:]
+
+    def changed_since(self, cursor: int) -> Tuple[int, List[Tuple[str, Dict[str, Any]]], List[str]]:
+        """
+        Net effect of the changes after `cursor`: the new cursor, the (content_hash, sample)
+        pairs added and still indexed, and the content hashes removed
+        """
+        changes = self.changes_since(cursor)
+        latest = {digest: operation for operation, digest in changes}
+        added = [(digest, self._samples.get(digest)) for digest, operation in latest.items() if operation == self.ADDED]
+        removed = [digest for digest, operation in latest.items() if operation == self.REMOVED]
+        return cursor + len(changes), [(digest, sample) for digest, sample in added if sample is not None], removed
+
+    def _write(self, records: List[Dict[str, Any]]) -> None:
+        """Append already applied records with a single write and flush"""
+        if records:
+            self._log.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+            self._log.flush()
+
+    def classify(self, sample_id: Optional[str], digest: str) -> str:
+        """Classify a sample as new, a duplicate, or an update of a known sample_id"""
+        known = self._ids.get(sample_id) if sample_id is not None else None
+        if known == digest:
+            return self.DUPLICATE
+        if known is not None:
+            return self.UPDATED
+        return self.DUPLICATE if digest in self._samples else self.NEW
+
+    def record_sample(self, sample_id: Optional[str], digest: str, sample: Dict[str, Any]) -> str:
+        """Record a canonical sample unless it is already indexed; return its status"""
+        return self.record_samples([(sample_id, digest, sample)])[0]
+
+    def record_samples(self, samples: List[Tuple[Optional[str], str, Dict[str, Any]]]) -> List[str]:
+        """Record (sample_id, content_hash, canonical sample) triples with a single write; return their statuses"""
+        statuses = []
+        records = []
+        with self._lock:
+            for sample_id, digest, sample in samples:
+                status = self.classify(sample_id, digest)
+                record = None
+                if status != self.DUPLICATE:
+                    record = {"type": "sample", "sample_id": sample_id, "content_hash": digest, "sample": sample}
+                elif sample_id is not None and sample_id not in self._ids:
+                    # Same content under a new label: remember the alias only
+                    record = {"type": "sample", "sample_id": sample_id, "content_hash": digest, "sample": None}
+                if record is not None:
+                    self._apply(record)
+                    records.append(record)
+                statuses.append(status)
+            self._write(records)
+        return statuses
+
+    def get_result(self, route: str, digest: str) -> Optional[Dict[str, Any]]:
+        return self._results.get(digest, {}).get(route)
+
+    def put_result(self, route: str, digest: str, result: Dict[str, Any]) -> None:
+        self.put_results([(route, digest, result)])
+
+    def put_results(self, results: List[Tuple[str, str, Dict[str, Any]]]) -> None:
+        """Record (route, content_hash, result) triples with a single write"""
+        records = [
+            {
+                "type": "result",
+                "route": route,
+                "content_hash": digest,
+                "calculator_version": self.calculator_version,
+                "result": result
+            }
+            for route, digest, result in results
+        ]
+        with self._lock:
+            for record in records:
+                self._apply(record)
+            self._write(records)
+
+    def get_sample(self, digest: str) -> Optional[Dict[str, Any]]:
+        return self._samples.get(digest)
+
+    def items(self) -> List[Tuple[str, Dict[str, Any]]]:
+        """(content_hash, canonical sample) pairs of the unique samples"""
+        return list(self._samples.items())
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "unique_samples": len(self._samples),
+            "sample_ids": len(self._ids),
+            "cached_results": sum(len(routes) for routes in self._results.values())
+        }
@@ -1,12 +1,23 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import List, Dict, Optional
+from pydantic import BaseModel, Field, PlainSerializer
+from typing import Annotated, List, Dict, Optional, Tuple
 import numpy as np
 import pandas as pd
 from scipy import stats
 import uvicorn
 import math
+import os
+import hashlib
+import inspect
+import json
+
+from ingest import IngestIndex, canonicalize_point, content_hash, normalize_metal_name, unit_factor
+from reports import ReportEngine, ScoredSamples, export_table
+from profiling import StackSampler
+from result_store import MAX_SAMPLE_ID_BYTES, ResultStore, SyncedResultStore
 
 app = FastAPI(
     title="MetalSense Environmental Calculations API",
@@ -23,6 +34,16 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def rounded(digits: int):
+    """Float kept unrounded for computation and rounded only when serialized"""
+    return Annotated[float, PlainSerializer(lambda value: round(value, digits), return_type=float)]
+
+Rounded2 = rounded(2)
+Rounded3 = rounded(3)
+Rounded4 = rounded(4)
+Rounded6 = rounded(6)
+Rounded8 = rounded(8)
+
 # Data models
 class HeavyMetalData(BaseModel):
     name: str
@@ -35,6 +56,7 @@ class HeavyMetalData(BaseModel):
     exposure_duration: Optional[float] = None  # years
     body_weight: Optional[float] = 70.0    # kg (default adult)
     intake_rate: Optional[float] = 2.0     # L/day (default water intake)
+    unit: Optional[str] = "mg/L"           # applies to concentration, standard and ideal
 
 class EnvironmentalDataPoint(BaseModel):
     latitude: float
@@ -44,45 +66,45 @@ class EnvironmentalDataPoint(BaseModel):
     sample_id: Optional[str] = None
 
 class HPIResult(BaseModel):
-    hpi_value: float
+    hpi_value: Rounded2
     classification: str
     individual_ratings: Dict[str, float]
     risk_level: str
 
 class MEIResult(BaseModel):
-    mei_value: float
+    mei_value: Rounded3
     classification: str
-    contamination_factors: Dict[str, float]
+    contamination_factors: Dict[str, Rounded3]
 
 class MetalIndexResult(BaseModel):
-    mi_value: float
+    mi_value: Rounded3
     classification: str
-    individual_indices: Dict[str, float]
+    individual_indices: Dict[str, Rounded3]
 
 class RiskIndexResult(BaseModel):
-    ri_value: float
+    ri_value: Rounded3
     classification: str
-    individual_risks: Dict[str, float]
+    individual_risks: Dict[str, Rounded3]
 
 class HazardQuotientResult(BaseModel):
-    individual_hq: Dict[str, float]
-    total_hq: float
+    individual_hq: Dict[str, Rounded4]
+    total_hq: Rounded4
     classification: str
 
 class HazardIndexResult(BaseModel):
-    hi_value: float
+    hi_value: Rounded4
     classification: str
-    individual_hq: Dict[str, float]
+    individual_hq: Dict[str, Rounded4]
 
 class CarcinogenicRiskResult(BaseModel):
-    individual_cr: Dict[str, float]
-    total_cr: float
+    individual_cr: Dict[str, Rounded8]
+    total_cr: Rounded8
     classification: str
     risk_level: str
 
 class NonCarcinogenicRiskResult(BaseModel):
-    individual_hq: Dict[str, float]
-    hazard_index: float
+    individual_hq: Dict[str, Rounded4]
+    hazard_index: Rounded4
     classification: str
     risk_level: str
 
@@ -96,6 +118,105 @@ class ComprehensiveRiskResult(BaseModel):
     carcinogenic_risk: CarcinogenicRiskResult
     non_carcinogenic_risk: NonCarcinogenicRiskResult
 
+class ReportRegion(BaseModel):
+    name: str
+    coordinates: List[List[float]]  # polygon ring of [longitude, latitude] pairs
+
+class ReportRequest(BaseModel):
+    group_by: str = "grid"          # "grid" or "region"
+    cell_size: float = 0.5          # degrees, for grid reports
+    regions: Optional[List[ReportRegion]] = None
+    period: str = "month"           # day, week, month, quarter or year
+    start_date: Optional[str] = None
+    end_date: Optional[str] = None
+    worst_sites: int = 5            # worst sites listed per region and period
+
+class ExposureScenario(BaseModel):
+    name: str
+    body_weight: float = Field(70.0, gt=0)          # kg
+    intake_rate: float = Field(2.0, ge=0)           # L/day
+    exposure_duration: float = Field(30.0, gt=0)    # years
+    exposure_frequency: float = Field(365.0, ge=0)  # days/year
+
+class ExposureMatrixRequest(BaseModel):
+    samples: List[EnvironmentalDataPoint]
+    scenarios: List[ExposureScenario]
+
+class ExposureMatrixResult(BaseModel):
+    precision: str
+    sample_ids: List[Optional[str]]
+    scenarios: List[str]
+    metals: List[str]
+    hi: List[List[Rounded4]]                       # samples × scenarios
+    total_cr: List[List[Rounded8]]                 # samples × scenarios
+    hi_exceedances: Dict[str, int]                 # samples with HI > 1 per scenario
+    cr_exceedances: Dict[str, int]                 # samples with CR > 1e-4 per scenario
+    hq: Optional[List[List[List[Rounded4]]]] = None  # samples × scenarios × metals
+    cr: Optional[List[List[List[Rounded8]]]] = None  # samples × scenarios × metals
+
+class StoredMetalResult(BaseModel):
+    quality: Rounded4
+    contamination_factor: Rounded3
+    risk: Rounded3
+    hq: Rounded4
+    cr: Rounded8
+
+class StoredResult(BaseModel):
+    sample_id: Optional[str]
+    content_hash: str               # first 32 hex characters of the SHA-256 content hash
+    latitude: Rounded6
+    longitude: Rounded6
+    sample_date: Optional[str]
+    hpi: Rounded2
+    mei: Rounded3
+    mi: Rounded3
+    ri: Rounded3
+    hi: Rounded4
+    total_cr: Rounded8
+    metals: Dict[str, StoredMetalResult]
+
+class ResultQueryResponse(BaseModel):
+    index: str
+    count: int
+    results: List[StoredResult]
+
+# Toxicity factors for common heavy metals (based on literature)
+TOXICITY_FACTORS = {
+    "Lead (Pb)": 5.0,
+    "Cadmium (Cd)": 30.0,
+    "Mercury (Hg)": 40.0,
+    "Arsenic (As)": 10.0,
+    "Chromium (Cr)": 2.0,
+    "Copper (Cu)": 5.0,
+    "Zinc (Zn)": 1.0,
+    "Nickel (Ni)": 5.0,
+    "Iron (Fe)": 1.0,
+    "Manganese (Mn)": 1.0
+}
+
+# Default reference doses (mg/kg/day) - EPA values
+REFERENCE_DOSES = {
+    "Lead (Pb)": 0.0036,
+    "Cadmium (Cd)": 0.001,
+    "Mercury (Hg)": 0.0003,
+    "Arsenic (As)": 0.0003,
+    "Chromium (Cr)": 0.003,
+    "Copper (Cu)": 0.04,
+    "Zinc (Zn)": 0.3,
+    "Nickel (Ni)": 0.02,
+    "Iron (Fe)": 0.7,
+    "Manganese (Mn)": 0.14
+}
+
+# Cancer slope factors (mg/kg/day)^-1 - EPA values
+SLOPE_FACTORS = {
+    "Arsenic (As)": 1.5,
+    "Cadmium (Cd)": 6.3,
+    "Chromium (Cr)": 42.0,
+    "Lead (Pb)": 0.0085,  # Lower bound estimate
+    "Nickel (Ni)": 1.7
+}
+
 # Heavy Metal Pollution Index Calculator
 class HPICalculator:
     @staticmethod
@@ -148,7 +269,7 @@ class HPICalculator:
             risk_level = "Critical"
         
         return HPIResult(
-            hpi_value=round(hpi_value, 2),
+            hpi_value=hpi_value,
             classification=classification,
             individual_ratings=individual_ratings,
             risk_level=risk_level
@@ -171,7 +292,7 @@ class MetalIndexCalculator:
         for metal in metals:
             # Metal Index for individual metal (MI = Ci/Si)
             mi = metal.concentration / metal.standard if metal.standard > 0 else 0
-            individual_indices[metal.name] = round(mi, 3)
+            individual_indices[metal.name] = mi
             total_mi += mi
         
         # Classification based on MI value
@@ -187,7 +308,7 @@ class MetalIndexCalculator:
             classification = "Extremely contaminated"
         
         return MetalIndexResult(
-            mi_value=round(total_mi, 3),
+            mi_value=total_mi,
             classification=classification,
             individual_indices=individual_indices
         )
@@ -203,27 +324,13 @@ class RiskIndexCalculator:
         if not metals:
             raise ValueError("No metal data provided")
         
-        # Toxicity factors for common heavy metals (based on literature)
-        toxicity_factors = {
-            "Lead (Pb)": 5.0,
-            "Cadmium (Cd)": 30.0,
-            "Mercury (Hg)": 40.0,
-            "Arsenic (As)": 10.0,
-            "Chromium (Cr)": 2.0,
-            "Copper (Cu)": 5.0,
-            "Zinc (Zn)": 1.0,
-            "Nickel (Ni)": 5.0,
-            "Iron (Fe)": 1.0,
-            "Manganese (Mn)": 1.0
-        }
-        
         individual_risks = {}
         total_ri = 0.0
         
         for metal in metals:
-            toxicity_factor = toxicity_factors.get(metal.name, 1.0)
+            toxicity_factor = TOXICITY_FACTORS.get(metal.name, 1.0)
             risk = metal.concentration * toxicity_factor
-            individual_risks[metal.name] = round(risk, 3)
+            individual_risks[metal.name] = risk
             total_ri += risk
         
         # Classification based on RI value
@@ -237,7 +344,7 @@ class RiskIndexCalculator:
             classification = "Very high risk"
         
         return RiskIndexResult(
-            ri_value=round(total_ri, 3),
+            ri_value=total_ri,
             classification=classification,
             individual_risks=individual_risks
         )
@@ -254,20 +361,6 @@ class HazardQuotientCalculator:
         if not metals:
             raise ValueError("No metal data provided")
         
-        # Default reference doses (mg/kg/day) - EPA values
-        reference_doses = {
-            "Lead (Pb)": 0.0036,
-            "Cadmium (Cd)": 0.001,
-            "Mercury (Hg)": 0.0003,
-            "Arsenic (As)": 0.0003,
-            "Chromium (Cr)": 0.003,
-            "Copper (Cu)": 0.04,
-            "Zinc (Zn)": 0.3,
-            "Nickel (Ni)": 0.02,
-            "Iron (Fe)": 0.7,
-            "Manganese (Mn)": 0.14
-        }
-        
         individual_hq = {}
         total_hq = 0.0
         
@@ -284,11 +377,11 @@ class HazardQuotientCalculator:
             cdi = (concentration * intake_rate * exposure_frequency * exposure_duration) / (body_weight * averaging_time)
             
             # Get reference dose
-            rfd = metal.reference_dose or reference_doses.get(metal.name, 0.001)
+            rfd = metal.reference_dose or REFERENCE_DOSES.get(metal.name, 0.001)
             
             # Calculate HQ
             hq = cdi / rfd if rfd > 0 else 0
-            individual_hq[metal.name] = round(hq, 4)
+            individual_hq[metal.name] = hq
             total_hq += hq
         
         # Classification based on total HQ
@@ -303,7 +396,7 @@ class HazardQuotientCalculator:
         
         return HazardQuotientResult(
             individual_hq=individual_hq,
-            total_hq=round(total_hq, 4),
+            total_hq=total_hq,
             classification=classification
         )
 
@@ -317,21 +410,23 @@ class HazardIndexCalculator:
         """
         hq_result = HazardQuotientCalculator.calculate_hazard_quotient(metals)
         
-        # Classification based on HI value
-        if hq_result.total_hq <= 1.0:
-            classification = "No significant risk"
-        elif hq_result.total_hq <= 4.0:
-            classification = "Low risk"
-        elif hq_result.total_hq <= 10.0:
-            classification = "Moderate risk"
-        else:
-            classification = "High risk"
-        
         return HazardIndexResult(
             hi_value=hq_result.total_hq,
-            classification=classification,
+            classification=HazardIndexCalculator.classify(hq_result.total_hq),
             individual_hq=hq_result.individual_hq
         )
+    
+    @staticmethod
+    def classify(hi_value: float) -> str:
+        """Classification based on the unrounded HI value"""
+        if hi_value <= 1.0:
+            return "No significant risk"
+        elif hi_value <= 4.0:
+            return "Low risk"
+        elif hi_value <= 10.0:
+            return "Moderate risk"
+        else:
+            return "High risk"
 
 # Carcinogenic Risk Calculator
 class CarcinogenicRiskCalculator:
@@ -344,20 +439,11 @@ class CarcinogenicRiskCalculator:
         if not metals:
             raise ValueError("No metal data provided")
         
-        # Cancer slope factors (mg/kg/day)^-1 - EPA values
-        slope_factors = {
-            "Arsenic (As)": 1.5,
-            "Cadmium (Cd)": 6.3,
-            "Chromium (Cr)": 42.0,
-            "Lead (Pb)": 0.0085,  # Lower bound estimate
-            "Nickel (Ni)": 1.7
-        }
-        
         individual_cr = {}
         total_cr = 0.0
         
         for metal in metals:
-            sf = metal.slope_factor or slope_factors.get(metal.name)
+            sf = metal.slope_factor or SLOPE_FACTORS.get(metal.name)
             
             if sf is not None:
                 # Default exposure parameters
@@ -393,8 +479,8 @@ class CarcinogenicRiskCalculator:
             risk_level = "Unacceptable"
         
         return CarcinogenicRiskResult(
-            individual_cr={k: round(v, 8) for k, v in individual_cr.items()},
-            total_cr=round(total_cr, 8),
+            individual_cr=individual_cr,
+            total_cr=total_cr,
             classification=classification,
             risk_level=risk_level
         )
@@ -407,23 +493,7 @@ class NonCarcinogenicRiskCalculator:
         Calculate Non-Carcinogenic Risk using Hazard Index approach
         """
         hq_result = HazardQuotientCalculator.calculate_hazard_quotient(metals)
-        
-        # Classification based on Hazard Index
-        if hq_result.total_hq <= 0.1:
-            classification = "No risk"
-            risk_level = "Safe"
-        elif hq_result.total_hq <= 1.0:
-            classification = "Acceptable risk"
-            risk_level = "Low"
-        elif hq_result.total_hq <= 4.0:
-            classification = "Low risk"
-            risk_level = "Moderate"
-        elif hq_result.total_hq <= 10.0:
-            classification = "Moderate risk"
-            risk_level = "High"
-        else:
-            classification = "High risk"
-            risk_level = "Very High"
+        classification, risk_level = NonCarcinogenicRiskCalculator.classify(hq_result.total_hq)
         
         return NonCarcinogenicRiskResult(
             individual_hq=hq_result.individual_hq,
@@ -431,6 +501,20 @@ class NonCarcinogenicRiskCalculator:
             classification=classification,
             risk_level=risk_level
         )
+    
+    @staticmethod
+    def classify(hazard_index: float) -> Tuple[str, str]:
+        """(classification, risk_level) based on the unrounded Hazard Index"""
+        if hazard_index <= 0.1:
+            return "No risk", "Safe"
+        elif hazard_index <= 1.0:
+            return "Acceptable risk", "Low"
+        elif hazard_index <= 4.0:
+            return "Low risk", "Moderate"
+        elif hazard_index <= 10.0:
+            return "Moderate risk", "High"
+        else:
+            return "High risk", "Very High"
 class MEICalculator:
     @staticmethod
     def calculate_mei(metals: List[HeavyMetalData]) -> MEIResult:
@@ -447,7 +531,7 @@ class MEICalculator:
         for metal in metals:
             # Contamination Factor (CF = Ci/Si)
             cf = metal.concentration / metal.standard if metal.standard > 0 else 0
-            contamination_factors[metal.name] = round(cf, 3)
+            contamination_factors[metal.name] = cf
             total_cf += cf
         
         mei_value = total_cf / len(metals)
@@ -463,11 +547,359 @@ class MEICalculator:
             classification = "Very high contamination"
         
         return MEIResult(
-            mei_value=round(mei_value, 3),
+            mei_value=mei_value,
             classification=classification,
             contamination_factors=contamination_factors
         )
 
+# Precision of the vectorized batch path; float32 halves memory and bandwidth for very large batches
+COMPUTE_DTYPES = {"float64": np.float64, "float32": np.float32}
+
+# Maximum relative error of the vectorized path against the scalar calculators
+VERIFY_TOLERANCES = {"float64": 1e-9, "float32": 1e-5}
+
+# Vectorized batch calculator
+class MatrixCalculator:
+    @staticmethod
+    def build_arrays(points: List[EnvironmentalDataPoint], precision: str = "float64") -> Dict[str, np.ndarray]:
+        """
+        Lay out a batch as (samples × metals) arrays with the scalar calculators' defaults applied.
+        Metal names and units are canonicalized on the way in, so raw request points can be passed.
+        Arrays are allocated in the target precision; metals missing from a sample are masked out.
+        """
+        if precision not in COMPUTE_DTYPES:
+            raise ValueError(f"Unsupported precision: {precision}")
+        if not points or any(not point.metals for point in points):
+            raise ValueError("No metal data provided")
+        dtype = COMPUTE_DTYPES[precision]
+        
+        canonical_names: Dict[str, str] = {}
+        factors: Dict[Optional[str], float] = {}
+        for point in points:
+            for metal in point.metals:
+                if metal.name not in canonical_names:
+                    canonical_names[metal.name] = normalize_metal_name(metal.name)
+                if metal.unit not in factors:
+                    factors[metal.unit] = unit_factor(metal.unit)
+        metal_names = sorted(set(canonical_names.values()))
+        column = {name: j for j, name in enumerate(metal_names)}
+        column = {name: column[canonical] for name, canonical in canonical_names.items()}
+        shape = (len(points), len(metal_names))
+        scaled = ["concentration", "standard", "ideal"]
+        fields = scaled + ["weight", "reference_dose", "slope_factor", "exposure_duration", "body_weight", "intake_rate"]
+        arrays = {field: np.full(shape, np.nan, dtype=dtype) for field in fields}
+        present = np.zeros(shape, dtype=bool)
+        
+        for i, point in enumerate(points):
+            for metal in point.metals:
+                j = column[metal.name]
+                if present[i, j]:
+                    raise ValueError(f"{metal_names[j]} is listed more than once")
+                factor = factors[metal.unit]
+                present[i, j] = True
+                for field in fields:
+                    value = getattr(metal, field)
+                    if value is not None:
+                        arrays[field][i, j] = value * factor if field in scaled else value
+        
+        def table(values: Dict[str, float], default: float) -> np.ndarray:
+            """Per-metal column from a lookup table such as REFERENCE_DOSES"""
+            return np.array([values.get(name, default) for name in metal_names], dtype=dtype)
+        
+        def falsy(values: np.ndarray) -> np.ndarray:
+            """Cells the scalar calculators would replace with a default (`value or default`)"""
+            return np.isnan(values) | (values == 0)
+        
+        absent = ~present
+        
+        standard, weight = arrays["standard"], arrays["weight"]
+        if np.any(np.isnan(weight) & present & (standard == 0)):
+            raise ValueError("Metal standard must be non-zero when no weight is given")
+        with np.errstate(divide="ignore"):
+            np.divide(1, standard, out=weight, where=np.isnan(weight) & present)
+        np.copyto(arrays["reference_dose"], table(REFERENCE_DOSES, 0.001), where=falsy(arrays["reference_dose"]))
+        np.copyto(arrays["slope_factor"], table(SLOPE_FACTORS, np.nan), where=falsy(arrays["slope_factor"]))
+        np.copyto(arrays["exposure_duration"], dtype(30), where=falsy(arrays["exposure_duration"]))
+        np.copyto(arrays["body_weight"], dtype(70), where=falsy(arrays["body_weight"]))
+        np.copyto(arrays["intake_rate"], dtype(2), where=falsy(arrays["intake_rate"]))
+        for field, values in arrays.items():
+            values[absent] = np.nan if field == "slope_factor" else 0
+        
+        # Read-only view; absent metals have zero concentration, so their risk is zero anyway
+        arrays["toxicity_factor"] = np.broadcast_to(table(TOXICITY_FACTORS, 1.0), shape)
+        arrays["present"] = present
+        arrays["metal_names"] = np.array(metal_names, dtype=object)
+        return arrays
+    
+    @staticmethod
+    def calculate(points: List[EnvironmentalDataPoint], precision: str = "float64") -> Dict[str, np.ndarray]:
+        """
+        Calculate HPI, MEI, MI, RI, HI and CR for a whole batch in one pass.
+        Same formulas as the scalar calculators, evaluated on unrounded arrays.
+        """
+        a = MatrixCalculator.build_arrays(points, precision)
+        present = a["present"]
+        c, s, ideal = a["concentration"], a["standard"], a["ideal"]
+        # NumPy scalars of the compute dtype keep every intermediate at that precision
+        dtype = c.dtype.type
+        hundred, zero = dtype(100), dtype(0)
+        
+        with np.errstate(divide="ignore", invalid="ignore"):
+            # HPI = Σ(Wi × Qi) / Σ(Wi)
+            quality = np.where(s == ideal, np.where(c > ideal, hundred, zero), hundred * (c - ideal) / (s - ideal))
+            quality = np.where(present, np.maximum(quality, zero), zero)
+            sum_weights = a["weight"].sum(axis=1)
+            hpi = np.where(sum_weights > 0, (a["weight"] * quality).sum(axis=1) / sum_weights, zero)
+            
+            # MI = Σ(Ci/Si), MEI = MI / n
+            cf = np.where(s > 0, c / s, zero)
+            mi = cf.sum(axis=1)
+            mei = mi / present.sum(axis=1).astype(dtype)
+            
+            # RI = Σ(Ci × Ti)
+            risk = c * a["toxicity_factor"]
+            
+            # HQ = CDI / RfD with averaging time 365 × ED
+            ed, bw, ir = a["exposure_duration"], a["body_weight"], a["intake_rate"]
+            cdi = np.where(present, (c * ir * 365 * ed) / (bw * 365 * ed), zero)
+            rfd = a["reference_dose"]
+            hq = np.where(rfd > 0, cdi / rfd, zero)
+            
+            # CR = CDI × SF with a 70 year lifetime
+            sf = a["slope_factor"]
+            cdi_lifetime = np.where(present, (c * ir * 365 * ed) / (bw * 70 * 365), zero)
+            cr = np.where(np.isnan(sf), zero, cdi_lifetime * sf)
+        
+        return {
+            "metal_names": a["metal_names"],
+            "present": present,
+            "quality": quality,
+            "contamination_factor": cf,
+            "risk": risk,
+            "hq": hq,
+            "cr": cr,
+            "hpi": hpi,
+            "mei": mei,
+            "mi": mi,
+            "ri": risk.sum(axis=1),
+            "hi": hq.sum(axis=1),
+            "total_cr": cr.sum(axis=1)
+        }
+    
+    @staticmethod
+    def calculate_exposure(points: List[EnvironmentalDataPoint], scenarios: List[ExposureScenario],
+                           precision: str = "float64") -> Dict[str, np.ndarray]:
+        """
+        Evaluate HQ, HI and CR for every sample × scenario pair by broadcasting.
+        Scenario exposure parameters replace the per-metal ones; RfD and SF still come from each metal.
+        CDI = (C × IR × EF × ED) / (BW × AT), AT = 365 × ED for HQ and 70 × 365 for CR
+        """
+        if not scenarios:
+            raise ValueError("No exposure scenarios provided")
+        names = [s.name for s in scenarios]
+        if len(set(names)) != len(names):
+            raise ValueError("Scenario names must be unique")
+        
+        a = MatrixCalculator.build_arrays(points, precision)
+        dtype = COMPUTE_DTYPES[precision]
+        
+        def scenario(field: str) -> np.ndarray:
+            """One scenario parameter shaped (1, scenarios, 1) for broadcasting"""
+            return np.array([getattr(s, field) for s in scenarios], dtype=dtype)[None, :, None]
+        
+        bw, ir = scenario("body_weight"), scenario("intake_rate")
+        ed, ef = scenario("exposure_duration"), scenario("exposure_frequency")
+        
+        # (samples, 1, metals) against (1, scenarios, 1) -> (samples, scenarios, metals)
+        intake = a["concentration"][:, None, :] * ir * ef * ed / bw
+        rfd = a["reference_dose"][:, None, :]
+        sf = a["slope_factor"][:, None, :]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            hq = np.where(rfd > 0, intake / (365 * ed) / rfd, 0).astype(dtype)
+            cr = np.where(np.isnan(sf), 0, intake / (70 * 365) * sf).astype(dtype)
+        
+        return {
+            "metal_names": a["metal_names"],
+            "hq": hq,
+            "cr": cr,
+            "hi": hq.sum(axis=2),
+            "total_cr": cr.sum(axis=2)
+        }
+    
+    @staticmethod
+    def verify(points: List[EnvironmentalDataPoint], matrix: Dict[str, np.ndarray], precision: str) -> Dict:
+        """
+        Compare vectorized totals against the scalar calculators within VERIFY_TOLERANCES.
+        Also counts samples whose HI / non-carcinogenic classification differs from releases that
+        classified on the HI rounded to 4 decimals, before rounding moved to serialization.
+        """
+        points = [EnvironmentalDataPoint(**canonicalize_point(point.dict())) for point in points]
+        reference = {
+            "hpi": [HPICalculator.calculate_hpi(p.metals).hpi_value for p in points],
+            "mei": [MEICalculator.calculate_mei(p.metals).mei_value for p in points],
+            "mi": [MetalIndexCalculator.calculate_metal_index(p.metals).mi_value for p in points],
+            "ri": [RiskIndexCalculator.calculate_risk_index(p.metals).ri_value for p in points],
+            "hi": [HazardQuotientCalculator.calculate_hazard_quotient(p.metals).total_hq for p in points],
+            "total_cr": [CarcinogenicRiskCalculator.calculate_carcinogenic_risk(p.metals).total_cr for p in points]
+        }
+        tolerance = VERIFY_TOLERANCES[precision]
+        max_relative_error = {}
+        for key, values in reference.items():
+            expected = np.array(values, dtype=np.float64)
+            actual = matrix[key].astype(np.float64)
+            scale = np.where(expected == 0, 1.0, np.abs(expected))
+            max_relative_error[key] = float(np.max(np.abs(actual - expected) / scale))
+        
+        legacy_hi = [round(value, 4) for value in reference["hi"]]
+        classification_changes = {
+            "hazard_index": sum(
+                HazardIndexCalculator.classify(value) != HazardIndexCalculator.classify(legacy)
+                for value, legacy in zip(reference["hi"], legacy_hi)
+            ),
+            "non_carcinogenic_risk": sum(
+                NonCarcinogenicRiskCalculator.classify(value) != NonCarcinogenicRiskCalculator.classify(legacy)
+                for value, legacy in zip(reference["hi"], legacy_hi)
+            )
+        }
+        
+        return {
+            "precision": precision,
+            "tolerance": tolerance,
+            "max_relative_error": max_relative_error,
+            "classification_changes": classification_changes,
+            "passed": all(error <= tolerance for error in max_relative_error.values())
+        }
+
+class BatchMatrixResult(BaseModel):
+    precision: str
+    sample_ids: List[Optional[str]]
+    hpi: List[Rounded2]
+    mei: List[Rounded3]
+    mi: List[Rounded3]
+    ri: List[Rounded3]
+    hi: List[Rounded4]
+    total_cr: List[Rounded8]
+    verification: Optional[Dict] = None
+
+# Fingerprint of the calculator code and lookup tables; cached results from any
+# other version are discarded, so formula or table changes are never masked
+CALCULATOR_VERSION = hashlib.sha256("".join([
+    *(inspect.getsource(calculator) for calculator in (
+        HPICalculator, MEICalculator, MetalIndexCalculator, RiskIndexCalculator,
+        HazardQuotientCalculator, HazardIndexCalculator, CarcinogenicRiskCalculator,
+        NonCarcinogenicRiskCalculator
+    )),
+    inspect.getsource(rounded),
+    json.dumps([TOXICITY_FACTORS, REFERENCE_DOSES, SLOPE_FACTORS], sort_keys=True)
+]).encode("utf-8")).hexdigest()[:16]
+
+# Ingest index: canonical samples and results, deduplicated by sample_id and content hash
+ingest_index = IngestIndex(os.getenv(
+    "METALSENSE_INGEST_INDEX",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "ingest-index.jsonl")
+), calculator_version=CALCULATOR_VERSION)
+
+def validate_sample(sample: dict) -> None:
+    """Reject canonical samples the calculators cannot score, so they never reach the index"""
+    if not sample["metals"]:
+        raise ValueError("No metal data provided")
+    if len((sample.get("sample_id") or "").encode("utf-8")) > MAX_SAMPLE_ID_BYTES:
+        raise ValueError(f"sample_id longer than {MAX_SAMPLE_ID_BYTES} bytes")
+    names = set()
+    for metal in sample["metals"]:
+        if metal["name"] in names:
+            raise ValueError(f"{metal['name']} is listed more than once")
+        names.add(metal["name"])
+        if metal["standard"] == 0 and metal.get("weight") is None:
+            raise ValueError(f"{metal['name']}: standard must be non-zero when no weight is given")
+
+def is_scorable(sample: dict) -> bool:
+    try:
+        validate_sample(sample)
+        return True
+    except ValueError:
+        return False
+
+def canonicalize_data_point(data: EnvironmentalDataPoint):
+    """Canonicalize metal names/units, validate and record the sample; returns (canonical sample, content_hash, status)"""
+    return canonicalize_data_points([data])[0]
+
+def canonicalize_data_points(data_points: List[EnvironmentalDataPoint]):
+    """
+    Canonicalize and validate a batch, then record it in the index with one write.
+    Returns (canonical sample, content_hash, status) per sample; nothing is recorded if any sample is invalid.
+    """
+    canonical = [canonicalize_point(data.dict()) for data in data_points]
+    for sample in canonical:
+        validate_sample(sample)
+    digests = [content_hash(sample) for sample in canonical]
+    statuses = ingest_index.record_samples([
+        (data.sample_id, digest, sample) for data, digest, sample in zip(data_points, digests, canonical)
+    ])
+    return list(zip(canonical, digests, statuses))
+
+def cached_result(route: str, sample: dict, digest: str, calculate) -> dict:
+    """Run `calculate` on a canonical sample unless a result for the same content is indexed"""
+    cached = ingest_index.get_result(route, digest)
+    if cached is not None:
+        return cached
+    result = calculate(EnvironmentalDataPoint(**sample)).dict()
+    ingest_index.put_result(route, digest, result)
+    return result
+
+def compute_once(route: str, data: EnvironmentalDataPoint, calculate) -> dict:
+    sample, digest, _ = canonicalize_data_point(data)
+    return cached_result(route, sample, digest, calculate)
+
+def calculate_comprehensive(point: EnvironmentalDataPoint) -> ComprehensiveRiskResult:
+    metals = point.metals
+    return ComprehensiveRiskResult(
+        hpi=HPICalculator.calculate_hpi(metals),
+        mei=MEICalculator.calculate_mei(metals),
+        metal_index=MetalIndexCalculator.calculate_metal_index(metals),
+        risk_index=RiskIndexCalculator.calculate_risk_index(metals),
+        hazard_quotient=HazardQuotientCalculator.calculate_hazard_quotient(metals),
+        hazard_index=HazardIndexCalculator.calculate_hazard_index(metals),
+        carcinogenic_risk=CarcinogenicRiskCalculator.calculate_carcinogenic_risk(metals),
+        non_carcinogenic_risk=NonCarcinogenicRiskCalculator.calculate_non_carcinogenic_risk(metals)
+    )
+
+def score_samples(items):
+    """
+    Parse and score (content_hash, canonical sample) pairs in one vectorized pass, leaving out
+    samples indexed before validation existed; returns (content hashes, points, matrix)
+    """
+    scorable = [(digest, EnvironmentalDataPoint(**sample)) for digest, sample in items if is_scorable(sample)]
+    points = [point for _, point in scorable]
+    return [digest for digest, _ in scorable], points, MatrixCalculator.calculate(points) if points else None
+
+# Report engine over the unique samples in the ingest index
+report_engine = ReportEngine()
+scored_samples = ScoredSamples(ingest_index, score_samples)
+
+def build_report(spec: dict):
+    version, frame = scored_samples.get()
+    return report_engine.build(frame, spec, version)
+
+# Compact binary store of scored samples, filled from the ingest index
+result_store = SyncedResultStore(ResultStore(os.getenv(
+    "METALSENSE_RESULT_STORE",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "results")
+), calculator_version=CALCULATOR_VERSION), ingest_index, score_samples)
+
+# Sampling profiler, only reachable when METALSENSE_ENABLE_PROFILING is set
+PROFILING_ENABLED = os.getenv("METALSENSE_ENABLE_PROFILING", "").lower() in ("1", "true", "yes")
+profiler = StackSampler()
+profiler.register(
+    HPICalculator, MEICalculator, MetalIndexCalculator, RiskIndexCalculator,
+    HazardQuotientCalculator, HazardIndexCalculator, CarcinogenicRiskCalculator,
+    NonCarcinogenicRiskCalculator, MatrixCalculator
+)
+
+def require_profiling():
+    if not PROFILING_ENABLED:
+        raise HTTPException(status_code=403, detail="Profiling is disabled; set METALSENSE_ENABLE_PROFILING=1")
+
 # API endpoints
 @app.get("/")
 async def root():
@@ -485,6 +917,13 @@ async def root():
             "/calculate/non-carcinogenic-risk",
             "/calculate/comprehensive",
             "/calculate/batch",
+            "/calculate/batch/matrix",
+            "/calculate/exposure-matrix",
+            "/ingest",
+            "/ingest/stats",
+            "/reports",
+            "/results/query",
+            "/results/stats",
             "/health"
         ]
     }
@@ -497,7 +936,7 @@ async def health_check():
 async def calculate_hpi(data: EnvironmentalDataPoint):
     """Calculate Heavy Metal Pollution Index for a single data point"""
     try:
-        result = HPICalculator.calculate_hpi(data.metals)
+        result = compute_once("hpi", data, lambda point: HPICalculator.calculate_hpi(point.metals))
         return result
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -506,7 +945,7 @@ async def calculate_hpi(data: EnvironmentalDataPoint):
 async def calculate_mei(data: EnvironmentalDataPoint):
     """Calculate Metal Evaluation Index for a single data point"""
     try:
-        result = MEICalculator.calculate_mei(data.metals)
+        result = compute_once("mei", data, lambda point: MEICalculator.calculate_mei(point.metals))
         return result
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -515,28 +954,114 @@ async def calculate_mei(data: EnvironmentalDataPoint):
 async def calculate_batch(data_points: List[EnvironmentalDataPoint]):
     """Calculate both HPI and MEI for multiple data points"""
     try:
+        calculators = {
+            "hpi": lambda p: HPICalculator.calculate_hpi(p.metals),
+            "mei": lambda p: MEICalculator.calculate_mei(p.metals)
+        }
         results = []
-        for point in data_points:
-            hpi_result = HPICalculator.calculate_hpi(point.metals)
-            mei_result = MEICalculator.calculate_mei(point.metals)
-            
-            results.append({
+        computed = {}
+        for point, (canonical, digest, status) in zip(data_points, canonicalize_data_points(data_points)):
+            result = {
                 "sample_id": point.sample_id,
                 "latitude": point.latitude,
                 "longitude": point.longitude,
-                "hpi": hpi_result.dict(),
-                "mei": mei_result.dict()
-            })
+                "content_hash": digest,
+                "duplicate": status == IngestIndex.DUPLICATE
+            }
+            for route, calculate in calculators.items():
+                cached = ingest_index.get_result(route, digest) or computed.get((route, digest))
+                if cached is None:
+                    cached = computed[(route, digest)] = calculate(EnvironmentalDataPoint(**canonical)).dict()
+                result[route] = cached
+            results.append(result)
+        
+        # Index the new results with one write
+        ingest_index.put_results([(route, digest, result) for (route, digest), result in computed.items()])
+        # Indexed results are already plain JSON; skip re-encoding them field by field
+        return JSONResponse(content={"results": results, "count": len(results)})
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/calculate/batch/matrix", response_model=BatchMatrixResult)
+async def calculate_batch_matrix(data_points: List[EnvironmentalDataPoint], precision: str = "float64",
+                                 verify: bool = False, record: bool = False):
+    """
+    Calculate index totals for many data points in one vectorized pass (precision: float64 or float32).
+    Samples are canonicalized in place without touching the ingest index; pass record=true to
+    also index them, with one write for the whole batch.
+    """
+    try:
+        matrix = MatrixCalculator.calculate(data_points, precision)
+        if record:
+            canonical = [canonicalize_point(point.dict()) for point in data_points]
+            ingest_index.record_samples([
+                (point.sample_id, content_hash(sample), sample) for point, sample in zip(data_points, canonical)
+            ])
+        
+        return BatchMatrixResult(
+            precision=precision,
+            sample_ids=[point.sample_id for point in data_points],
+            hpi=matrix["hpi"].tolist(),
+            mei=matrix["mei"].tolist(),
+            mi=matrix["mi"].tolist(),
+            ri=matrix["ri"].tolist(),
+            hi=matrix["hi"].tolist(),
+            total_cr=matrix["total_cr"].tolist(),
+            verification=MatrixCalculator.verify(data_points, matrix, precision) if verify else None
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/calculate/exposure-matrix", response_model=ExposureMatrixResult)
+async def calculate_exposure_matrix(request: ExposureMatrixRequest, precision: str = "float64", include_metals: bool = False):
+    """
+    Calculate HI and CR for every sample × exposure scenario (e.g. children, adults, pregnant women) in one pass.
+    Samples are canonicalized in place and not added to the ingest index.
+    """
+    try:
+        points = request.samples
+        matrix = MatrixCalculator.calculate_exposure(points, request.scenarios, precision)
+        names = [scenario.name for scenario in request.scenarios]
+        
+        return ExposureMatrixResult(
+            precision=precision,
+            sample_ids=[point.sample_id for point in points],
+            scenarios=names,
+            metals=list(matrix["metal_names"]),
+            hi=matrix["hi"].tolist(),
+            total_cr=matrix["total_cr"].tolist(),
+            hi_exceedances=dict(zip(names, (matrix["hi"] > 1.0).sum(axis=0).tolist())),
+            cr_exceedances=dict(zip(names, (matrix["total_cr"] > 1e-4).sum(axis=0).tolist())),
+            hq=matrix["hq"].tolist() if include_metals else None,
+            cr=matrix["cr"].tolist() if include_metals else None
+        )
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/ingest")
+async def ingest_samples(data_points: List[EnvironmentalDataPoint]):
+    """Canonicalize and deduplicate samples by sample_id and content hash without computing indices"""
+    try:
+        samples = []
+        counts = {IngestIndex.NEW: 0, IngestIndex.DUPLICATE: 0, IngestIndex.UPDATED: 0}
+        for point, (_, digest, status) in zip(data_points, canonicalize_data_points(data_points)):
+            counts[status] += 1
+            samples.append({"sample_id": point.sample_id, "content_hash": digest, "status": status})
         
-        return {"results": results, "count": len(results)}
+        return {"samples": samples, "counts": counts, "count": len(samples)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/ingest/stats")
+async def get_ingest_stats():
+    """Get the size of the deduplicated sample index"""
+    return ingest_index.stats()
+
 @app.post("/calculate/metal-index", response_model=MetalIndexResult)
 async def calculate_metal_index(data: EnvironmentalDataPoint):
     """Calculate Metal Index for a single data point"""
     try:
-        result = MetalIndexCalculator.calculate_metal_index(data.metals)
+        result = compute_once("metal-index", data, lambda point: MetalIndexCalculator.calculate_metal_index(point.metals))
         return result
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -545,7 +1070,7 @@ async def calculate_metal_index(data: EnvironmentalDataPoint):
 async def calculate_risk_index(data: EnvironmentalDataPoint):
     """Calculate Risk Index for a single data point"""
     try:
-        result = RiskIndexCalculator.calculate_risk_index(data.metals)
+        result = compute_once("risk-index", data, lambda point: RiskIndexCalculator.calculate_risk_index(point.metals))
         return result
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -554,7 +1079,7 @@ async def calculate_risk_index(data: EnvironmentalDataPoint):
 async def calculate_hazard_quotient(data: EnvironmentalDataPoint):
     """Calculate Hazard Quotient for a single data point"""
     try:
-        result = HazardQuotientCalculator.calculate_hazard_quotient(data.metals)
+        result = compute_once("hazard-quotient", data, lambda point: HazardQuotientCalculator.calculate_hazard_quotient(point.metals))
         return result
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -563,7 +1088,7 @@ async def calculate_hazard_quotient(data: EnvironmentalDataPoint):
 async def calculate_hazard_index(data: EnvironmentalDataPoint):
     """Calculate Hazard Index for a single data point"""
     try:
-        result = HazardIndexCalculator.calculate_hazard_index(data.metals)
+        result = compute_once("hazard-index", data, lambda point: HazardIndexCalculator.calculate_hazard_index(point.metals))
         return result
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -572,7 +1097,7 @@ async def calculate_hazard_index(data: EnvironmentalDataPoint):
 async def calculate_carcinogenic_risk(data: EnvironmentalDataPoint):
     """Calculate Carcinogenic Risk for a single data point"""
     try:
-        result = CarcinogenicRiskCalculator.calculate_carcinogenic_risk(data.metals)
+        result = compute_once("carcinogenic-risk", data, lambda point: CarcinogenicRiskCalculator.calculate_carcinogenic_risk(point.metals))
         return result
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -581,7 +1106,7 @@ async def calculate_carcinogenic_risk(data: EnvironmentalDataPoint):
 async def calculate_non_carcinogenic_risk(data: EnvironmentalDataPoint):
     """Calculate Non-Carcinogenic Risk for a single data point"""
     try:
-        result = NonCarcinogenicRiskCalculator.calculate_non_carcinogenic_risk(data.metals)
+        result = compute_once("non-carcinogenic-risk", data, lambda point: NonCarcinogenicRiskCalculator.calculate_non_carcinogenic_risk(point.metals))
         return result
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -590,28 +1115,83 @@ async def calculate_non_carcinogenic_risk(data: EnvironmentalDataPoint):
 async def calculate_comprehensive_risk(data: EnvironmentalDataPoint):
     """Calculate all environmental indices and risk assessments for a single data point"""
     try:
-        hpi_result = HPICalculator.calculate_hpi(data.metals)
-        mei_result = MEICalculator.calculate_mei(data.metals)
-        mi_result = MetalIndexCalculator.calculate_metal_index(data.metals)
-        ri_result = RiskIndexCalculator.calculate_risk_index(data.metals)
-        hq_result = HazardQuotientCalculator.calculate_hazard_quotient(data.metals)
-        hi_result = HazardIndexCalculator.calculate_hazard_index(data.metals)
-        cr_result = CarcinogenicRiskCalculator.calculate_carcinogenic_risk(data.metals)
-        ncr_result = NonCarcinogenicRiskCalculator.calculate_non_carcinogenic_risk(data.metals)
-        
-        return ComprehensiveRiskResult(
-            hpi=hpi_result,
-            mei=mei_result,
-            metal_index=mi_result,
-            risk_index=ri_result,
-            hazard_quotient=hq_result,
-            hazard_index=hi_result,
-            carcinogenic_risk=cr_result,
-            non_carcinogenic_risk=ncr_result
+        return compute_once("comprehensive", data, calculate_comprehensive)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/reports")
+async def generate_report(request: ReportRequest, format: str = "json", table: str = "summary"):
+    """
+    Aggregate indexed samples by region or grid cell and period.
+    JSON returns both tables; CSV returns the table named by `table` (summary or worst_sites).
+    """
+    try:
+        tables = await run_in_threadpool(build_report, request.dict())
+        if format == "csv":
+            if table not in tables:
+                raise ValueError(f"Unknown report table: {table}")
+            return Response(content=export_table(tables[table], "csv"), media_type="text/csv")
+        
+        return {name: export_table(frame, format) for name, frame in tables.items()}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/results/query", response_model=ResultQueryResponse)
+async def query_results(index: str = "hi", gt: Optional[float] = None, gte: Optional[float] = None,
+                        lt: Optional[float] = None, lte: Optional[float] = None,
+                        descending: bool = False, limit: int = 100, offset: int = 0):
+    """Stored results whose index (hpi, mei, mi, ri, hi, total_cr) lies in a range, e.g. ?index=hi&gt=1"""
+    try:
+        count, results = await run_in_threadpool(
+            result_store.query, index, offset, limit,
+            gt=gt, gte=gte, lt=lt, lte=lte, descending=descending
         )
+        
+        return ResultQueryResponse(index=index, count=count, results=results)
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/results/stats")
+async def get_result_store_stats():
+    """Get record count and on-disk size of the binary result store"""
+    try:
+        return await run_in_threadpool(result_store.stats)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/admin/profile/start")
+async def start_profile(route: Optional[str] = None, duration: float = 30.0, interval_ms: float = 5.0):
+    """Sample request stacks for `duration` seconds, optionally only for one route path"""
+    require_profiling()
+    try:
+        profiler.start(duration=duration, interval=interval_ms / 1000, route=route)
+        return profiler.summary()
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.post("/admin/profile/stop")
+async def stop_profile():
+    """Stop the running profiling session early"""
+    require_profiling()
+    await run_in_threadpool(profiler.stop)
+    return profiler.summary()
+
+@app.get("/admin/profile")
+async def get_profile():
+    """Estimated time per calculator class and request phase for the last session"""
+    require_profiling()
+    return profiler.summary()
+
+@app.get("/admin/profile/collapsed")
+async def download_profile():
+    """Download collapsed stacks for flamegraph.pl or speedscope"""
+    require_profiling()
+    return Response(
+        content=profiler.collapsed(),
+        media_type="text/plain",
+        headers={"Content-Disposition": "attachment; filename=metalsense-profile.collapsed"}
+    )
+
 @app.get("/standards/heavy-metals")
 async def get_heavy_metal_standards():
     """Get standard permissible values for common heavy metals (WHO/EPA standards)"""
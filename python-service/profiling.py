@@ -0,0 +1,203 @@
+"""
+Opt-in sampling profiler for MetalSense request handling.
+
+A background thread periodically captures the Python stacks of every thread
+and keeps those that are serving an HTTP request (optionally a single route).
+Samples are aggregated as collapsed stacks ("root;...;leaf count"), the input
+format of flamegraph.pl and speedscope, and attributed to request phases and
+calculator classes. Nothing is installed on the request path, so profiling
+costs nothing while the sampler is not running.
+"""
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Any, Dict, List, Optional
+
+# Functions whose presence on a stack marks a request phase
+INGEST_FUNCTIONS = {"canonicalize_data_points", "record_samples", "put_results"}
+VALIDATION_FUNCTIONS = {"request_body_to_args", "solve_dependencies", "_validate", "validate_python"}
+SERIALIZATION_FUNCTIONS = {"serialize_response", "jsonable_encoder", "render", "model_dump", "dict"}
+
+# ASGI callables that carry the request scope as a local
+SCOPE_FUNCTIONS = {"__call__", "app", "handle"}
+
+
+def _owner(frame, owners: Dict[Any, str]) -> Optional[str]:
+    """
+    Class a frame's function belongs to. code.co_qualname only exists on Python 3.11+,
+    so registered code objects (needed for staticmethods) and self/cls locals come first.
+    """
+    code = frame.f_code
+    if code in owners:
+        return owners[code]
+    qualname = getattr(code, "co_qualname", None)
+    if qualname is not None:
+        return qualname.rsplit(".", 1)[0] if "." in qualname else None
+    if code.co_argcount:
+        first = frame.f_locals.get(code.co_varnames[0])
+        if code.co_varnames[0] == "self" and first is not None:
+            return type(first).__qualname__
+        if code.co_varnames[0] == "cls" and isinstance(first, type):
+            return first.__qualname__
+    return None
+
+
+def _frame_label(frame, owners: Dict[Any, str]) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__") or os.path.splitext(os.path.basename(code.co_filename))[0]
+    qualname = getattr(code, "co_qualname", None)
+    if qualname is None:
+        owner = _owner(frame, owners)
+        qualname = f"{owner}.{code.co_name}" if owner else code.co_name
+    return f"{module}:{qualname}"
+
+
+def _request_path(stack) -> Optional[str]:
+    """Path of the HTTP request a stack is serving, or None if the thread is idle"""
+    for frame in stack:
+        if frame.f_code.co_name in SCOPE_FUNCTIONS:
+            scope = frame.f_locals.get("scope")
+            if isinstance(scope, dict) and scope.get("type") == "http":
+                return scope.get("path")
+    return None
+
+
+def classify_stack(stack, owners: Optional[Dict[Any, str]] = None) -> str:
+    """
+    Attribute a stack (leaf first) to a calculator class or request phase.
+    The innermost calculator frame wins, then ingest, serialization and validation.
+    """
+    for frame in stack:
+        owner = _owner(frame, owners or {})
+        if owner is not None and owner.split(".")[0].endswith("Calculator"):
+            return owner.split(".")[0]
+    names = {frame.f_code.co_name for frame in stack}
+    if names & INGEST_FUNCTIONS:
+        return "ingest"
+    if names & SERIALIZATION_FUNCTIONS:
+        return "serialization"
+    if names & VALIDATION_FUNCTIONS:
+        return "validation"
+    return "other"
+
+
+class StackSampler:
+    """Samples request stacks for a time window and aggregates them"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._owners: Dict[Any, str] = {}
+        self._reset(route=None, interval=0.005, duration=0.0)
+
+    def _reset(self, route: Optional[str], interval: float, duration: float) -> None:
+        self.route = route
+        self.interval = interval
+        self.duration = duration
+        self.started_at: Optional[float] = None
+        self.ended_at: Optional[float] = None
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.categories: Counter = Counter()
+
+    def register(self, *classes) -> None:
+        """
+        Record which class owns each method's code object, so frames are attributed
+        to classes on Pythons without code.co_qualname, including staticmethods
+        """
+        for cls in classes:
+            for attribute in vars(cls).values():
+                function = getattr(attribute, "__func__", attribute)
+                code = getattr(function, "__code__", None)
+                if code is not None:
+                    self._owners[code] = cls.__qualname__
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration: float, interval: float, route: Optional[str] = None) -> None:
+        """Start sampling every `interval` seconds for `duration` seconds, discarding earlier samples"""
+        if duration <= 0 or interval <= 0:
+            raise ValueError("duration and interval must be positive")
+        if self.running:
+            raise ValueError("A profiling session is already running")
+        with self._lock:
+            self._reset(route, interval, duration)
+            self.started_at = time.time()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="metalsense-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        deadline = time.monotonic() + self.duration
+        # The sampler needs the GIL to look at other threads; without a short switch
+        # interval it only gets it when they block on I/O, which biases the samples
+        switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(switch_interval, self.interval / 100))
+        try:
+            while not self._stop.wait(self.interval) and time.monotonic() < deadline:
+                for thread_id, frame in sys._current_frames().items():
+                    if thread_id != own_id:
+                        self._sample(frame)
+        finally:
+            sys.setswitchinterval(switch_interval)
+            self.ended_at = time.time()
+
+    def _sample(self, frame) -> None:
+        stack = []
+        while frame is not None:
+            stack.append(frame)
+            frame = frame.f_back
+        path = _request_path(stack)
+        if path is None or (self.route is not None and path != self.route):
+            return
+        collapsed = ";".join(_frame_label(f, self._owners) for f in reversed(stack))
+        with self._lock:
+            self.samples += 1
+            self.stacks[collapsed] += 1
+            self.categories[classify_stack(stack, self._owners)] += 1
+
+    def collapsed(self) -> str:
+        """Collapsed-stack text for flamegraph.pl or speedscope"""
+        with self._lock:
+            return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def summary(self, top: int = 10) -> Dict[str, Any]:
+        """Estimated time per calculator class / request phase and the hottest leaf frames"""
+        with self._lock:
+            interval_ms = self.interval * 1000
+            leaves: Counter = Counter()
+            for stack, count in self.stacks.items():
+                leaves[stack.rsplit(";", 1)[-1]] += count
+            breakdown: List[Dict[str, Any]] = [
+                {
+                    "name": name,
+                    "samples": count,
+                    "estimated_ms": count * interval_ms,
+                    "share": count / self.samples
+                }
+                for name, count in self.categories.most_common()
+            ]
+            return {
+                "running": self.running,
+                "route": self.route,
+                "interval_ms": interval_ms,
+                "duration_s": self.duration,
+                "started_at": self.started_at,
+                "ended_at": self.ended_at,
+                "samples": self.samples,
+                "breakdown": breakdown,
+                "hottest_frames": [
+                    {"frame": frame, "samples": count} for frame, count in leaves.most_common(top)
+                ]
+            }
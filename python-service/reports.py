@@ -0,0 +1,230 @@
+"""
+Pre-aggregated regional reports for MetalSense.
+
+Scored samples are grouped by region polygon or grid cell and by period with
+pandas groupby, and the materialized tables are cached per report spec and
+dataset version so repeated requests for the same report are free.
+"""
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+# pandas period frequencies for the supported report periods
+PERIODS = {
+    "day": "D",
+    "week": "W",
+    "month": "M",
+    "quarter": "Q",
+    "year": "Y"
+}
+
+# Decimal places applied when a report table is exported
+EXPORT_DIGITS = {
+    "avg_hpi": 2,
+    "max_hpi": 2,
+    "hpi": 2,
+    "avg_mei": 3,
+    "mei": 3,
+    "avg_hi": 4,
+    "max_hi": 4,
+    "hi": 4,
+    "avg_total_cr": 8,
+    "max_total_cr": 8,
+    "total_cr": 8,
+    "share_above_who_limit": 4
+}
+
+# Sample totals carried into the scored frame
+SCORE_COLUMNS = ("hpi", "mei", "hi", "total_cr")
+
+UNASSIGNED = "Unassigned"
+UNDATED = "Undated"
+
+
+def points_in_polygon(longitudes: np.ndarray, latitudes: np.ndarray, ring: List[List[float]]) -> np.ndarray:
+    """
+    Even-odd ray casting test of many points against one polygon ring.
+    The ring is a list of [longitude, latitude] pairs as in GeoJSON.
+    """
+    inside = np.zeros(len(longitudes), dtype=bool)
+    vertices = np.asarray(ring, dtype=np.float64)
+    x1, y1 = vertices[:, 0], vertices[:, 1]
+    x2, y2 = np.roll(x1, -1), np.roll(y1, -1)
+    for ax, ay, bx, by in zip(x1, y1, x2, y2):
+        crosses = (ay > latitudes) != (by > latitudes)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            x_cross = ax + (latitudes - ay) * (bx - ax) / (by - ay)
+        inside ^= crosses & (longitudes < x_cross)
+    return inside
+
+
+def assign_regions(scored: pd.DataFrame, regions: List[Dict[str, Any]]) -> pd.Series:
+    """Label each sample with the first region polygon containing it"""
+    labels = np.full(len(scored), UNASSIGNED, dtype=object)
+    longitudes = scored["longitude"].to_numpy(dtype=np.float64)
+    latitudes = scored["latitude"].to_numpy(dtype=np.float64)
+    for region in regions:
+        inside = points_in_polygon(longitudes, latitudes, region["coordinates"])
+        labels[inside & (labels == UNASSIGNED)] = region["name"]
+    return pd.Series(labels, index=scored.index)
+
+
+def assign_grid_cells(scored: pd.DataFrame, cell_size: float) -> pd.Series:
+    """Label each sample with the south-west corner of its grid cell"""
+    if cell_size <= 0:
+        raise ValueError("cell_size must be positive")
+    cell_lat = np.floor(scored["latitude"].to_numpy() / cell_size) * cell_size
+    cell_lon = np.floor(scored["longitude"].to_numpy() / cell_size) * cell_size
+    labels = [f"{lat:.4f},{lon:.4f}" for lat, lon in zip(cell_lat, cell_lon)]
+    return pd.Series(labels, index=scored.index, dtype=object)
+
+
+def assign_periods(scored: pd.DataFrame, period: str) -> pd.Series:
+    if period not in PERIODS:
+        raise ValueError(f"Unsupported period: {period}")
+    dates = pd.to_datetime(scored["sample_date"], errors="coerce")
+    periods = dates.dt.to_period(PERIODS[period]).astype(str)
+    return periods.where(dates.notna(), UNDATED)
+
+
+def scored_frame(digests: List[str], points: List[Any], matrix: Optional[Dict[str, np.ndarray]]) -> pd.DataFrame:
+    """Frame of scored samples indexed by content hash, from MatrixCalculator.calculate output"""
+    frame = pd.DataFrame({
+        "sample_id": [point.sample_id for point in points],
+        "latitude": [point.latitude for point in points],
+        "longitude": [point.longitude for point in points],
+        "sample_date": [point.sample_date for point in points]
+    }, index=pd.Index(digests, dtype=object, name="content_hash"))
+    if matrix is not None:
+        for column in SCORE_COLUMNS:
+            frame[column] = matrix[column]
+        frame["above_who_limit"] = (matrix["contamination_factor"] > 1).any(axis=1)
+    else:
+        for column in SCORE_COLUMNS:
+            frame[column] = pd.Series(dtype=float)
+        frame["above_who_limit"] = pd.Series(dtype=bool)
+    return frame
+
+
+class ScoredSamples:
+    """
+    Scores of the unique samples in an ingest index, kept in step with its change log.
+    After the first full pass only samples added or removed since are rescored.
+    `score` maps (content_hash, sample) pairs to (content hashes, points, matrix) of the scorable ones.
+    """
+
+    def __init__(self, index, score: Callable):
+        self.index = index
+        self.score = score
+        self.version: Optional[int] = None
+        self.frame: Optional[pd.DataFrame] = None
+        self._lock = threading.Lock()
+
+    def get(self) -> Tuple[int, pd.DataFrame]:
+        """The scored frame and the index version it reflects"""
+        with self._lock:
+            if self.frame is None:
+                self.version = self.index.version
+                self.frame = scored_frame(*self.score(self.index.items()))
+            elif self.version != self.index.version:
+                self.version, added, removed = self.index.changed_since(self.version)
+                changed = set(removed) | {digest for digest, _ in added}
+                frame = self.frame.drop(index=[digest for digest in changed if digest in self.frame.index])
+                new = scored_frame(*self.score(added))
+                if len(new):
+                    frame = pd.concat([frame, new]) if len(frame) else new
+                self.frame = frame
+            return self.version, self.frame
+
+
+class ReportEngine:
+    """Builds and caches report tables from a DataFrame of scored samples"""
+
+    def __init__(self, max_cached: int = 32):
+        self.max_cached = max_cached
+        self._lock = threading.Lock()
+        self._cache: "OrderedDict[Tuple[str, Any], Dict[str, pd.DataFrame]]" = OrderedDict()
+
+    @staticmethod
+    def spec_key(spec: Dict[str, Any]) -> str:
+        encoded = json.dumps(spec, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+    def build(self, scored: pd.DataFrame, spec: Dict[str, Any], version: Any) -> Dict[str, pd.DataFrame]:
+        """
+        Return the "summary" and "worst_sites" tables for a report spec.
+        Tables are cached until the dataset version changes.
+        """
+        key = (self.spec_key(spec), version)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+
+        tables = self._aggregate(scored, spec)
+        with self._lock:
+            self._cache[key] = tables
+            if len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return tables
+
+    @staticmethod
+    def _aggregate(scored: pd.DataFrame, spec: Dict[str, Any]) -> Dict[str, pd.DataFrame]:
+        frame = scored.copy()
+        if spec.get("start_date") or spec.get("end_date"):
+            dates = pd.to_datetime(frame["sample_date"], errors="coerce")
+            keep = dates.notna()
+            if spec.get("start_date"):
+                keep &= dates >= pd.Timestamp(spec["start_date"])
+            if spec.get("end_date"):
+                keep &= dates <= pd.Timestamp(spec["end_date"])
+            frame = frame[keep]
+
+        if spec["group_by"] == "region":
+            if not spec.get("regions"):
+                raise ValueError("Region reports require at least one region polygon")
+            frame["region"] = assign_regions(frame, spec["regions"])
+        elif spec["group_by"] == "grid":
+            frame["region"] = assign_grid_cells(frame, spec["cell_size"])
+        else:
+            raise ValueError(f"Unsupported group_by: {spec['group_by']}")
+        frame["period"] = assign_periods(frame, spec["period"])
+
+        groups = frame.groupby(["region", "period"], sort=True)
+        summary = groups.agg(
+            samples=("hpi", "size"),
+            avg_hpi=("hpi", "mean"),
+            max_hpi=("hpi", "max"),
+            avg_mei=("mei", "mean"),
+            avg_hi=("hi", "mean"),
+            max_hi=("hi", "max"),
+            avg_total_cr=("total_cr", "mean"),
+            max_total_cr=("total_cr", "max"),
+            share_above_who_limit=("above_who_limit", "mean")
+        ).reset_index()
+
+        worst_sites = (
+            frame.sort_values("hpi", ascending=False, kind="stable")
+            .groupby(["region", "period"], sort=True)
+            .head(spec["worst_sites"])
+            .sort_values(["region", "period", "hpi"], ascending=[True, True, False], kind="stable")
+            [["region", "period", "sample_id", "latitude", "longitude", "sample_date", "hpi", "hi", "total_cr"]]
+            .reset_index(drop=True)
+        )
+        return {"summary": summary, "worst_sites": worst_sites}
+
+
+def export_table(table: pd.DataFrame, fmt: str) -> Any:
+    """Round a report table for output and render it as CSV text or JSON records"""
+    digits = {column: places for column, places in EXPORT_DIGITS.items() if column in table.columns}
+    rounded = table.round(digits)
+    if fmt == "csv":
+        return rounded.to_csv(index=False)
+    if fmt == "json":
+        return json.loads(rounded.to_json(orient="records"))
+    raise ValueError(f"Unsupported format: {fmt}")
@@ -0,0 +1,340 @@
+"""
+Compact binary result storage for MetalSense.
+
+Each scored sample is packed into a fixed-width 72 byte record holding its
+location, date and index totals, and each of its metals into a 21 byte record
+keyed by a one byte metal ID, instead of a JSON dict keyed by full metal names.
+The files are memory-mapped, so reads are zero-copy views, and range queries
+such as "all samples with HI > 1" use precomputed argsort indexes with binary
+search instead of scanning.
+
+Layout of the store directory:
+    samples.bin     SAMPLE_DTYPE records
+    metals.bin      METAL_DTYPE records, contiguous per sample
+    strings.bin     UTF-8 sample_ids referenced by offset/length
+    metals.json     metal ID -> metal name
+    version         record layout and fingerprint of the calculators that scored the records
+    <index>.idx     uint32 row numbers sorted by that index value
+"""
+import datetime
+import json
+import os
+import threading
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from ingest import CANONICAL_METALS
+
+SAMPLE_DTYPE = np.dtype([
+    ("digest", "u1", (16,)),        # first 16 bytes of the SHA-256 content hash
+    ("latitude", "<f8"),            # float64 so coordinates round-trip exactly
+    ("longitude", "<f8"),
+    ("sample_date", "<i4"),         # days since 1970-01-01, -1 if unknown
+    ("hpi", "<f4"),
+    ("mei", "<f4"),
+    ("mi", "<f4"),
+    ("ri", "<f4"),
+    ("hi", "<f4"),
+    ("total_cr", "<f4"),
+    ("metal_offset", "<u4"),
+    ("metal_count", "u1"),
+    ("id_offset", "<u4"),
+    ("id_length", "<u2"),
+    ("flags", "u1")
+])
+
+METAL_DTYPE = np.dtype([
+    ("metal_id", "u1"),
+    ("quality", "<f4"),
+    ("contamination_factor", "<f4"),
+    ("risk", "<f4"),
+    ("hq", "<f4"),
+    ("cr", "<f4")
+])
+
+# Sample totals that can be range-queried
+INDEXED_FIELDS = ("hpi", "mei", "mi", "ri", "hi", "total_cr")
+
+# Per-metal values stored for every sample
+METAL_FIELDS = ("quality", "contamination_factor", "risk", "hq", "cr")
+
+# Bumped whenever SAMPLE_DTYPE or METAL_DTYPE change; stores in another layout are rebuilt
+STORE_FORMAT = 2
+
+DELETED = 1
+EPOCH = datetime.date(1970, 1, 1)
+MAX_METALS = 255
+MAX_SAMPLE_ID_BYTES = np.iinfo(SAMPLE_DTYPE["id_length"]).max
+
+
+def _date_to_days(value: Optional[str]) -> int:
+    try:
+        return (datetime.date.fromisoformat(value[:10]) - EPOCH).days
+    except (TypeError, ValueError):
+        return -1
+
+
+def _days_to_date(days: int) -> Optional[str]:
+    return (EPOCH + datetime.timedelta(days=int(days))).isoformat() if days >= 0 else None
+
+
+class ResultStore:
+    """
+    Append-only memory-mapped store of scored samples with sorted indexes.
+    A store written by a different calculator version is emptied on open, so
+    it is refilled with current scores instead of serving stale ones.
+    """
+
+    def __init__(self, directory: str, calculator_version: str = ""):
+        self.directory = directory
+        self.calculator_version = calculator_version
+        self._version = f"{STORE_FORMAT}:{calculator_version}"
+        os.makedirs(directory, exist_ok=True)
+        self._samples_path = os.path.join(directory, "samples.bin")
+        self._metals_path = os.path.join(directory, "metals.bin")
+        self._strings_path = os.path.join(directory, "strings.bin")
+        self._registry_path = os.path.join(directory, "metals.json")
+        self._version_path = os.path.join(directory, "version")
+        for path in (self._samples_path, self._metals_path, self._strings_path):
+            open(path, "ab").close()
+        if self._stored_version() != self._version:
+            self._clear()
+
+        if os.path.exists(self._registry_path):
+            with open(self._registry_path, "r", encoding="utf-8") as f:
+                self.metal_names: List[str] = json.load(f)
+        else:
+            self.metal_names = list(CANONICAL_METALS)
+            self._save_registry()
+        self._metal_ids = {name: i for i, name in enumerate(self.metal_names)}
+
+        self._remap()
+        self._rows = {
+            bytes(digest): row for row, digest in enumerate(self.samples["digest"])
+            if not self.samples["flags"][row] & DELETED
+        }
+
+    def _stored_version(self) -> Optional[str]:
+        if not os.path.exists(self._version_path):
+            # Stores written before versioning are only current if empty
+            return self._version if os.path.getsize(self._samples_path) == 0 else None
+        with open(self._version_path, "r", encoding="utf-8") as f:
+            return f.read().strip()
+
+    def _clear(self) -> None:
+        for path in (self._samples_path, self._metals_path, self._strings_path):
+            open(path, "wb").close()
+        for field in INDEXED_FIELDS:
+            index_path = os.path.join(self.directory, f"{field}.idx")
+            if os.path.exists(index_path):
+                os.remove(index_path)
+        with open(self._version_path, "w", encoding="utf-8") as f:
+            f.write(self._version)
+
+    def _save_registry(self) -> None:
+        with open(self._registry_path, "w", encoding="utf-8") as f:
+            json.dump(self.metal_names, f)
+
+    @staticmethod
+    def _map(path: str, dtype) -> np.ndarray:
+        count = os.path.getsize(path) // np.dtype(dtype).itemsize
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        return np.memmap(path, dtype=dtype, mode="r", shape=(count,))
+
+    def _remap(self) -> None:
+        self.samples = self._map(self._samples_path, SAMPLE_DTYPE)
+        self.metals = self._map(self._metals_path, METAL_DTYPE)
+        self.strings = self._map(self._strings_path, np.uint8)
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    @staticmethod
+    def _key(digest: str) -> bytes:
+        return bytes.fromhex(digest[:32])
+
+    def contains(self, digest: str) -> bool:
+        return self._key(digest) in self._rows
+
+    def digests(self) -> List[str]:
+        """Truncated (32 hex character) content hashes of the live records"""
+        return [key.hex() for key in self._rows]
+
+    def append(self, digests: List[str], points: List[Any], matrix: Dict[str, np.ndarray]) -> None:
+        """
+        Pack and append scored samples.
+        `matrix` is the output of MatrixCalculator.calculate for `points`.
+        """
+        encoded_ids = [(point.sample_id or "").encode("utf-8") for point in points]
+        id_lengths = np.array([len(encoded) for encoded in encoded_ids], dtype=np.int64)
+        if len(id_lengths) and id_lengths.max() > MAX_SAMPLE_ID_BYTES:
+            raise ValueError(f"sample_id longer than {MAX_SAMPLE_ID_BYTES} bytes")
+
+        metal_names = list(matrix["metal_names"])
+        for name in metal_names:
+            if name not in self._metal_ids:
+                if len(self.metal_names) >= MAX_METALS:
+                    raise ValueError("Result store metal registry is full")
+                self._metal_ids[name] = len(self.metal_names)
+                self.metal_names.append(name)
+                self._save_registry()
+        column_ids = np.array([self._metal_ids[name] for name in metal_names], dtype=np.uint8)
+
+        present = matrix["present"]
+        rows, columns = np.nonzero(present)
+        metal_records = np.zeros(len(rows), dtype=METAL_DTYPE)
+        metal_records["metal_id"] = column_ids[columns]
+        metal_records["quality"] = matrix["quality"][rows, columns]
+        metal_records["contamination_factor"] = matrix["contamination_factor"][rows, columns]
+        metal_records["risk"] = matrix["risk"][rows, columns]
+        metal_records["hq"] = matrix["hq"][rows, columns]
+        metal_records["cr"] = matrix["cr"][rows, columns]
+
+        counts = present.sum(axis=1)
+
+        records = np.zeros(len(points), dtype=SAMPLE_DTYPE)
+        records["digest"] = np.frombuffer(b"".join(self._key(d) for d in digests), dtype=np.uint8).reshape(-1, 16)
+        records["latitude"] = [point.latitude for point in points]
+        records["longitude"] = [point.longitude for point in points]
+        records["sample_date"] = [_date_to_days(point.sample_date) for point in points]
+        for field in INDEXED_FIELDS:
+            records[field] = matrix[field]
+        records["metal_offset"] = len(self.metals) + np.concatenate(([0], np.cumsum(counts)[:-1]))
+        records["metal_count"] = counts
+        records["id_offset"] = len(self.strings) + np.concatenate(([0], np.cumsum(id_lengths)[:-1]))
+        records["id_length"] = id_lengths
+
+        first_row = len(self.samples)
+        with open(self._metals_path, "ab") as f:
+            f.write(metal_records.tobytes())
+        with open(self._strings_path, "ab") as f:
+            f.write(b"".join(encoded_ids))
+        with open(self._samples_path, "ab") as f:
+            f.write(records.tobytes())
+        for offset, digest in enumerate(digests):
+            self._rows[self._key(digest)] = first_row + offset
+        self._remap()
+
+    def delete(self, digests: List[str]) -> None:
+        """Flag records as deleted in place; they are skipped by queries"""
+        flags_offset = SAMPLE_DTYPE.fields["flags"][1]
+        with open(self._samples_path, "r+b") as f:
+            for digest in digests:
+                row = self._rows.pop(self._key(digest), None)
+                if row is not None:
+                    f.seek(row * SAMPLE_DTYPE.itemsize + flags_offset)
+                    f.write(bytes([int(self.samples["flags"][row]) | DELETED]))
+        self._remap()
+
+    def _index(self, field: str) -> np.ndarray:
+        """Row numbers sorted by `field`, rebuilt when records were appended since it was written"""
+        if field not in INDEXED_FIELDS:
+            raise ValueError(f"Unknown index: {field}")
+        path = os.path.join(self.directory, f"{field}.idx")
+        order = self._map(path, np.uint32) if os.path.exists(path) else np.zeros(0, dtype=np.uint32)
+        if len(order) != len(self.samples):
+            order = None  # release the old mapping before rewriting the file
+            np.argsort(self.samples[field], kind="stable").astype(np.uint32).tofile(path)
+            order = self._map(path, np.uint32)
+        return order
+
+    def query(self, field: str, gt: Optional[float] = None, gte: Optional[float] = None,
+              lt: Optional[float] = None, lte: Optional[float] = None,
+              descending: bool = False) -> np.ndarray:
+        """Rows whose `field` lies in the given bounds, ordered by that field"""
+        order = self._index(field)
+        values = self.samples[field]
+        start, stop = 0, len(order)
+        if gt is not None:
+            start = max(start, int(np.searchsorted(values, np.float32(gt), side="right", sorter=order)))
+        if gte is not None:
+            start = max(start, int(np.searchsorted(values, np.float32(gte), side="left", sorter=order)))
+        if lt is not None:
+            stop = min(stop, int(np.searchsorted(values, np.float32(lt), side="left", sorter=order)))
+        if lte is not None:
+            stop = min(stop, int(np.searchsorted(values, np.float32(lte), side="right", sorter=order)))
+
+        rows = np.asarray(order[start:max(start, stop)])
+        rows = rows[(self.samples["flags"][rows] & DELETED) == 0]
+        return rows[::-1] if descending else rows
+
+    def record(self, row: int) -> Dict[str, Any]:
+        """Decode one record and its metals"""
+        sample = self.samples[row]
+        id_offset, id_length = int(sample["id_offset"]), int(sample["id_length"])
+        metal_offset = int(sample["metal_offset"])
+        metals = self.metals[metal_offset:metal_offset + int(sample["metal_count"])]
+        result = {
+            "sample_id": self.strings[id_offset:id_offset + id_length].tobytes().decode("utf-8") or None,
+            "content_hash": bytes(sample["digest"]).hex(),
+            "latitude": float(sample["latitude"]),
+            "longitude": float(sample["longitude"]),
+            "sample_date": _days_to_date(sample["sample_date"])
+        }
+        for field in INDEXED_FIELDS:
+            result[field] = float(sample[field])
+        result["metals"] = {
+            self.metal_names[metal["metal_id"]]: {field: float(metal[field]) for field in METAL_FIELDS}
+            for metal in metals
+        }
+        return result
+
+    def stats(self) -> Dict[str, Any]:
+        size = sum(os.path.getsize(path) for path in (self._samples_path, self._metals_path, self._strings_path))
+        return {
+            "records": len(self._rows),
+            "deleted": len(self.samples) - len(self._rows),
+            "bytes": size,
+            "bytes_per_record": size / len(self.samples) if len(self.samples) else 0.0
+        }
+
+
+class SyncedResultStore:
+    """
+    A ResultStore kept in step with an ingest index. The first sync reconciles the whole
+    store; later ones only apply the index changes made since.
+    `score` maps (content_hash, sample) pairs to (content hashes, points, matrix) of the scorable ones.
+    """
+
+    def __init__(self, store: ResultStore, index, score: Callable, chunk_size: int = 10000):
+        self.store = store
+        self.index = index
+        self.score = score
+        self.chunk_size = chunk_size
+        self.version: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _sync(self) -> None:
+        if self.version is None:
+            version = self.index.version
+            samples = self.index.items()
+            indexed = {digest[:32] for digest, _ in samples}
+            stale = [digest for digest in self.store.digests() if digest not in indexed]
+        elif self.version != self.index.version:
+            version, samples, removed = self.index.changed_since(self.version)
+            stale = [digest for digest in removed if self.store.contains(digest)]
+        else:
+            return
+
+        if stale:
+            self.store.delete(stale)
+        missing = [(digest, sample) for digest, sample in samples if not self.store.contains(digest)]
+        for start in range(0, len(missing), self.chunk_size):
+            digests, points, matrix = self.score(missing[start:start + self.chunk_size])
+            if points:
+                self.store.append(digests, points, matrix)
+        self.version = version
+
+    def query(self, field: str, offset: int = 0, limit: int = 100, **bounds) -> Tuple[int, List[Dict[str, Any]]]:
+        """Sync, then return the match count and the decoded records of one page"""
+        with self._lock:
+            self._sync()
+            rows = self.store.query(field, **bounds)
+            return len(rows), [self.store.record(row) for row in rows[offset:offset + limit]]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._sync()
+            return self.store.stats()
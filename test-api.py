@@ -2,10 +2,17 @@
 """
 Test script for MetalSense Environmental Calculations API
 Run this script after starting the Python service to verify all endpoints work correctly.
+
+The checks write to the service they run against: TEST-001 and the samples of
+the behaviour checks (sample_ids TEST-DEDUP-*, TEST-REPORT-* and TEST-STORE-*,
+dated 1901 for the report check) stay in its ingest index, result store and
+reports. Run it against a development instance, e.g. one started with
+METALSENSE_INGEST_INDEX and METALSENSE_RESULT_STORE pointing at a scratch directory.
 """
 
 import requests
 import json
+import uuid
 
 BASE_URL = "http://127.0.0.1:8001"
 
@@ -85,6 +92,103 @@ def test_endpoint(endpoint, data=None):
         print(f"❌ {endpoint}: ERROR - {str(e)}")
         return False
 
+def check(name, passed, detail=""):
+    """Print the outcome of a behaviour check"""
+    if passed:
+        print(f"✅ {name}: SUCCESS")
+    else:
+        print(f"❌ {name}: FAILED")
+        if detail:
+            print(f"   {detail}")
+    return passed
+
+def post(endpoint, data):
+    response = requests.post(f"{BASE_URL}{endpoint}", json=data)
+    response.raise_for_status()
+    return response.json()
+
+def unique_sample(tag):
+    """Copy of test_data with a fresh sample_id and content that has never been indexed"""
+    token = uuid.uuid4()
+    return dict(test_data, sample_id=f"TEST-{tag}-{token.hex[:8]}", latitude=test_data["latitude"] + token.int % 10**6 / 1e9)
+
+def test_deduplication():
+    """Resubmissions are duplicates, aliased names/units still match, new content under a known sample_id is an update"""
+    sample = unique_sample("DEDUP")
+    aliased = dict(sample, metals=[
+        dict(metal, name=metal["name"].split(" (")[1][:-1], concentration=metal["concentration"] * 1000,
+             standard=metal["standard"] * 1000, unit="µg/L")
+        for metal in sample["metals"]
+    ])
+    corrected = dict(sample, metals=[dict(sample["metals"][0], concentration=0.09)] + sample["metals"][1:])
+    
+    statuses = [post("/ingest", [body])["samples"][0]["status"] for body in (sample, sample, aliased, corrected)]
+    expected = ["new", "duplicate", "duplicate", "updated"]
+    return check("sample deduplication", statuses == expected, f"expected {expected}, got {statuses}")
+
+def test_float32_verification():
+    """float32 batch totals stay within the documented 1e-5 relative error of the scalar calculators"""
+    batch = [test_data, dict(test_data, metals=test_data["metals"][:1]), dict(test_data, metals=test_data["metals"][1:])]
+    verification = post("/calculate/batch/matrix?precision=float32&verify=true", batch)["verification"]
+    passed = verification["passed"] and verification["tolerance"] == 1e-5
+    return check("float32 batch verification", passed, f"max relative error: {verification['max_relative_error']}")
+
+def test_grid_report():
+    """Samples in a known 1° grid reduce to one summary row per cell, with HPI matching /calculate/hpi"""
+    sites = [("TEST-REPORT-1", 10.2, 20.3, 0.08), ("TEST-REPORT-2", 10.7, 20.9, 0.02), ("TEST-REPORT-3", 11.5, 20.5, 0.05)]
+    samples = [
+        dict(test_data, sample_id=sample_id, latitude=latitude, longitude=longitude, sample_date="1901-01-15",
+             metals=[dict(test_data["metals"][0], concentration=lead)] + test_data["metals"][1:])
+        for sample_id, latitude, longitude, lead in sites
+    ]
+    post("/ingest", samples)
+    hpi = [post("/calculate/hpi", sample)["hpi_value"] for sample in samples]
+    
+    spec = {"group_by": "grid", "cell_size": 1, "period": "month", "start_date": "1901-01-01", "end_date": "1901-01-31"}
+    summary = post("/reports", spec)["summary"]
+    cells = {row["region"]: (row["samples"], row["max_hpi"]) for row in summary}
+    expected = {"10.0000,20.0000": (2, max(hpi[:2])), "11.0000,20.0000": (1, hpi[2])}
+    passed = cells.keys() == expected.keys() and all(
+        cells[cell][0] == count and abs(cells[cell][1] - max_hpi) < 0.01 for cell, (count, max_hpi) in expected.items()
+    )
+    return check("grid report", passed, f"expected {expected}, got {cells}")
+
+def test_result_store_query():
+    """A freshly ingested sample is found by a result-store range query around its HI"""
+    sample = unique_sample("STORE")
+    post("/ingest", [sample])
+    hi = post("/calculate/hazard-index", sample)["hi_value"]
+    
+    # Stored totals are float32 and the response HI is rounded to 4 decimals
+    response = requests.get(f"{BASE_URL}/results/query", params={
+        "index": "hi", "gte": hi - 1e-4, "lte": hi + 1e-4, "limit": 1000
+    })
+    response.raise_for_status()
+    results = response.json()["results"]
+    found = [result for result in results if result["sample_id"] == sample["sample_id"]]
+    passed = len(found) == 1 and abs(found[0]["hi"] - hi) < 1e-4
+    return check("result store range query", passed, f"{sample['sample_id']} with HI {hi} not in {len(results)} results")
+
+def test_exposure_matrix():
+    """Exposure-matrix HI per scenario matches /calculate/hazard-index with the same exposure parameters"""
+    scenarios = [
+        {"name": "adult", "body_weight": 70, "intake_rate": 2.0, "exposure_duration": 30},
+        {"name": "child", "body_weight": 15, "intake_rate": 1.0, "exposure_duration": 6}
+    ]
+    matrix = post("/calculate/exposure-matrix", {"samples": [test_data], "scenarios": scenarios})
+    
+    expected = []
+    for scenario in scenarios:
+        # No sample_id, so TEST-001 is not replaced by this variant in the index
+        exposed = {key: value for key, value in test_data.items() if key != "sample_id"}
+        exposed["metals"] = [
+            dict(metal, body_weight=scenario["body_weight"], intake_rate=scenario["intake_rate"],
+                 exposure_duration=scenario["exposure_duration"])
+            for metal in test_data["metals"]
+        ]
+        expected.append(post("/calculate/hazard-index", exposed)["hi_value"])
+    return check("exposure matrix HI", matrix["hi"][0] == expected, f"expected {expected}, got {matrix['hi'][0]}")
+
 def main():
     print("🧪 Testing MetalSense Environmental Calculations API")
     print("=" * 60)
@@ -113,6 +217,24 @@ def main():
             success_count += 1
         print()
     
+    # Behaviour checks
+    behaviour_checks = [
+        test_deduplication,
+        test_float32_verification,
+        test_grid_report,
+        test_result_store_query,
+        test_exposure_matrix
+    ]
+    total_count += len(behaviour_checks)
+    
+    for behaviour_check in behaviour_checks:
+        try:
+            if behaviour_check():
+                success_count += 1
+        except requests.exceptions.RequestException as e:
+            print(f"❌ {behaviour_check.__name__}: ERROR - {str(e)}")
+        print()
+    
     print("=" * 60)
     print(f"📊 Test Results: {success_count}/{total_count} endpoints successful")
     